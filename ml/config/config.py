@@ -23,6 +23,38 @@ TRACKING_IOU_THRESH = config["prediction_tracking_iou_threshold"]
 MIN_FRAMES_THRESH = config["min_frames_threshold"]
 MAX_TIME_BACK = config["max_seconds_back"]
 
+# Prediction performance
+DETECTION_BATCH_SIZE = config["detection_batch_size"]
+PIPELINED_PREDICTION = config["pipelined_prediction"]
+PIPELINE_QUEUE_SIZE = config["pipeline_queue_size"]
+PREDICTION_TRACKER = config["prediction_tracker"]
+TRACKING_FRAME_SCALE = config["tracking_frame_scale"]
+TRACKING_THREADS = config["tracking_threads"]
+ADAPTIVE_KEYFRAMES = config["adaptive_keyframes"]
+MIN_FRAMES_BETWEEN_PREDICTIONS = config["min_frames_between_predictions"]
+MAX_FRAMES_BETWEEN_PREDICTIONS = config["max_frames_between_predictions"]
+KEYFRAME_MOTION_THRESHOLDS = config["keyframe_motion_thresholds"]
+STATIC_FRAME_THRESHOLD = config["static_frame_threshold"]
+PREDICTION_WORKERS = config["prediction_workers"]
+SEGMENT_SECONDS = config["segment_seconds"]
+SEGMENT_OVERLAP_SECONDS = config["segment_overlap_seconds"]
+EVALUATION_WORKERS = config["evaluation_workers"]
+EVALUATION_MEMORY_BUDGET_GB = config["evaluation_memory_budget_gb"]
+MODEL_MEMORY_GB = config["model_memory_gb"]
+INFERENCE_BACKEND = config["inference_backend"]
+ONNX_THREADS = config["onnx_threads"]
+QUANTIZE_MODEL = config["quantize_model"]
+CALIBRATION_FRAMES = config["calibration_frames"]
+DETECTOR_MIN_SIDE = config["detector_min_side"]
+DETECTOR_MAX_SIDE = config["detector_max_side"]
+DETECTION_CACHE = config["detection_cache"]
+DETECTION_CACHE_FOLDER = config["detection_cache_folder"]
+CROSS_CLASS_NMS_THRESHOLD = config["cross_class_nms_threshold"]
+VIDEO_PRESET = config["video_preset"]
+VIDEO_CRF = config["video_crf"]
+VIDEO_THREADS = config["video_threads"]
+BURN_IN_VIDEO = config["burn_in_video"]
+
 # Tracking
 LENGTH = config['tracking_vid_length']  # length of video in milliseconds
 TRACKING_USERS = config['tracking_users']
@@ -52,6 +84,7 @@ S3_METRICS_FOLDER = os.getenv("AWS_S3_BUCKET_METRICS_FOLDER")
 S3_BUCKET_AIVIDEOS_FOLDER = os.getenv("AWS_S3_BUCKET_AIVIDEOS_FOLDER")
 S3_LOGS_FOLDER = os.getenv("AWS_S3_BUCKET_LOGS_FOLDER")
 S3_STDOUT_FOLDER = os.getenv("AWS_S3_BUCKET_STDOUT_FOLDER")
+S3_DETECTIONS_FOLDER = os.getenv("AWS_S3_BUCKET_DETECTIONS_FOLDER")
 
 # Database variables
 DB_NAME = os.getenv("DB_NAME")
@@ -0,0 +1,244 @@
+"""
+Benchmarks for the prediction pipeline, run from the ml folder on a local
+video file. For example:
+
+    python -m predict.benchmark tracking dive.mp4 --objects 30 --threads 1 4 8 16
+    python -m predict.benchmark inference dive.mp4 weights.h5 --backends keras onnx
+    python -m predict.benchmark parity dive.mp4 weights.h5
+    python -m predict.benchmark detector-sizes dive.mp4 weights.h5 --min-sides 0 608 800
+"""
+import argparse
+import math
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from config import config
+from predict import matching
+from predict import predict
+from utils.tracking_frames import make_tracking_frame
+
+
+def read_frames(video_path, num_frames):
+    """ Reads up to num_frames resized frames from the start of a video """
+    vid = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < num_frames:
+        check, frame = vid.read()
+        if not check:
+            break
+        frames.append(cv2.resize(
+            frame, (config.RESIZED_WIDTH, config.RESIZED_HEIGHT)))
+    vid.release()
+    return frames
+
+
+def video_size(video_path):
+    """ (width, height) of the source video """
+    vid = cv2.VideoCapture(video_path)
+    size = (int(vid.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            int(vid.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    vid.release()
+    return size
+
+
+def grid_detections(num_objects):
+    """ Fake (box, confidence, label) detections spread over the frame """
+    columns = math.ceil(math.sqrt(num_objects))
+    rows = math.ceil(num_objects / columns)
+    width = config.RESIZED_WIDTH / columns
+    height = config.RESIZED_HEIGHT / rows
+    detections = []
+    for index in range(num_objects):
+        x1 = (index % columns + 0.25) * width
+        y1 = (index // columns + 0.25) * height
+        detections.append(((x1, y1, x1 + width / 2, y1 + height / 2), 1, 0))
+    return detections
+
+
+def benchmark_tracking(frames, num_objects, threads):
+    """ Times updating num_objects tracked objects over the frames, with
+        each number of tracking threads
+    """
+    tracking_frames = [
+        make_tracking_frame(frame, config.TRACKING_FRAME_SCALE)
+        for frame in frames]
+    detections = grid_detections(num_objects)
+    baseline_time = None
+    print(f'{config.PREDICTION_TRACKER} tracker, {num_objects} objects, '
+          f'{len(frames)} frames, scale {config.TRACKING_FRAME_SCALE}')
+    for num_threads in threads:
+        pool = ThreadPoolExecutor(num_threads) if num_threads > 1 else None
+        objects = [
+            predict.Tracked_object(detection, tracking_frames[0], 0)
+            for detection in detections]
+        start = time.perf_counter()
+        for frame_num, frame in enumerate(tracking_frames[1:], 1):
+            predict.map_objects(
+                lambda obj: obj.update(frame, frame_num), objects, pool)
+        run_time = time.perf_counter() - start
+        if pool is not None:
+            pool.shutdown()
+        baseline_time = baseline_time or run_time
+        print(f'{num_threads:>3} threads: {run_time:.2f}s, '
+              f'{(len(frames) - 1) / run_time:.1f} frames/sec, '
+              f'speedup {baseline_time / run_time:.2f}x')
+
+
+def benchmark_inference(frames, weights, backends, batch_size):
+    """ Times running the model on the frames with each inference backend """
+    baseline_time = None
+    print(f'{len(frames)} frames, batches of {batch_size}')
+    for backend in backends:
+        model = predict.init_model(weights, backend)
+        start = time.perf_counter()
+        for index in range(0, len(frames), batch_size):
+            predict.get_predictions(frames[index:index + batch_size], model)
+        run_time = time.perf_counter() - start
+        baseline_time = baseline_time or run_time
+        print(f'{backend:>6}: {run_time:.2f}s, '
+              f'{len(frames) / run_time:.2f} frames/sec, '
+              f'speedup {baseline_time / run_time:.2f}x')
+
+
+def check_parity(frames, weights, batch_size, iou_thresh, score_tolerance):
+    """ Compares the (thresholded) detections of the onnx backend with the
+        keras backend's. Every detection should have a match with the same
+        label, an IOU of at least iou_thresh and a score within
+        score_tolerance. Returns whether they all did.
+    """
+    keras_model = predict.init_model(weights, 'keras')
+    onnx_model = predict.init_model(weights, 'onnx')
+    matched = 0
+    mismatched = 0
+    max_score_difference = 0
+    for index in range(0, len(frames), batch_size):
+        batch = frames[index:index + batch_size]
+        for keras_detections, onnx_detections in zip(
+                predict.get_predictions(batch, keras_model),
+                predict.get_predictions(batch, onnx_model)):
+            matches = matching.match_boxes(
+                keras_detections.boxes, onnx_detections.boxes, iou_thresh)
+            same = matches != -1
+            same[same] = (onnx_detections.labels[matches[same]] ==
+                          keras_detections.labels[same])
+            matched += same.sum()
+            mismatched += len(keras_detections) - same.sum()
+            # onnx detections without a keras detection
+            mismatched += len(onnx_detections) - (matches != -1).sum()
+            if same.any():
+                max_score_difference = max(
+                    max_score_difference,
+                    np.abs(keras_detections.scores[same] -
+                           onnx_detections.scores[matches[same]]).max())
+    print(f'{matched} detections matched, {mismatched} mismatched, '
+          f'max score difference {max_score_difference:.4f}')
+    return mismatched == 0 and max_score_difference <= score_tolerance
+
+
+def benchmark_detector_sizes(frames, weights, source_size, min_sides,
+                             batch_size, iou_thresh):
+    """ Times the model with each detector_min_side, and compares its
+        detections with those on the full resized frames (min side 0): the
+        share of those it finds (recall) and of its detections that are
+        among them (precision)
+    """
+    model = predict.init_model(weights)
+    runs = {}
+    for min_side in [0] + [side for side in min_sides if side != 0]:
+        config.DETECTOR_MIN_SIDE = min_side
+        size = predict.detector_size(*source_size)
+        detections = []
+        start = time.perf_counter()
+        for index in range(0, len(frames), batch_size):
+            detections.extend(predict.get_predictions(
+                frames[index:index + batch_size], model, size))
+        runs[min_side] = (size, time.perf_counter() - start, detections)
+
+    _, baseline_time, reference = runs[0]
+    print(f'{len(frames)} frames, source {source_size[0]}x{source_size[1]}')
+    for min_side in min_sides:
+        size, run_time, detections = runs[min_side]
+        found = 0
+        for reference_detections, size_detections in zip(
+                reference, detections):
+            matches = matching.match_boxes(
+                reference_detections.boxes, size_detections.boxes,
+                iou_thresh)
+            same = matches != -1
+            found += (size_detections.labels[matches[same]] ==
+                      reference_detections.labels[same]).sum()
+        total_reference = sum(len(d) for d in reference)
+        total = sum(len(d) for d in detections)
+        print(f'min side {min_side:>4} ({size[0]}x{size[1]}): '
+              f'{len(frames) / run_time:.2f} frames/sec, '
+              f'speedup {baseline_time / run_time:.2f}x, '
+              f'recall {found / max(total_reference, 1):.3f}, '
+              f'precision {found / max(total, 1):.3f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    tracking = commands.add_parser(
+        'tracking', help='tracked object updates per thread pool size')
+    tracking.add_argument('video')
+    tracking.add_argument('--frames', type=int, default=300)
+    tracking.add_argument('--objects', type=int, default=30)
+    tracking.add_argument('--threads', type=int, nargs='+',
+                          default=[1, 2, 4, 8, 16])
+
+    inference = commands.add_parser(
+        'inference', help='model throughput per inference backend')
+    inference.add_argument('video')
+    inference.add_argument('weights')
+    inference.add_argument('--frames', type=int, default=64)
+    inference.add_argument('--batch-size', type=int,
+                           default=config.DETECTION_BATCH_SIZE)
+    inference.add_argument('--backends', nargs='+', default=['keras', 'onnx'])
+
+    parity = commands.add_parser(
+        'parity', help='onnx backend detections against the keras backend')
+    parity.add_argument('video')
+    parity.add_argument('weights')
+    parity.add_argument('--frames', type=int, default=64)
+    parity.add_argument('--batch-size', type=int,
+                        default=config.DETECTION_BATCH_SIZE)
+    parity.add_argument('--iou', type=float, default=0.9)
+    parity.add_argument('--score-tolerance', type=float, default=0.01)
+
+    sizes = commands.add_parser(
+        'detector-sizes', help='model speed and accuracy per detector size')
+    sizes.add_argument('video')
+    sizes.add_argument('weights')
+    sizes.add_argument('--frames', type=int, default=64)
+    sizes.add_argument('--batch-size', type=int,
+                       default=config.DETECTION_BATCH_SIZE)
+    sizes.add_argument('--min-sides', type=int, nargs='+',
+                       default=[0, 1080, 800, 608, 480])
+    sizes.add_argument('--iou', type=float, default=0.5)
+
+    args = parser.parse_args()
+    frames = read_frames(args.video, args.frames)
+    if args.command == 'tracking':
+        benchmark_tracking(frames, args.objects, args.threads)
+    elif args.command == 'inference':
+        benchmark_inference(
+            frames, args.weights, args.backends, args.batch_size)
+    elif args.command == 'parity':
+        if not check_parity(frames, args.weights, args.batch_size, args.iou,
+                            args.score_tolerance):
+            sys.exit(1)
+    elif args.command == 'detector-sizes':
+        benchmark_detector_sizes(
+            frames, args.weights, video_size(args.video), args.min_sides,
+            args.batch_size, args.iou)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+import os
+
+import numpy as np
+from botocore.exceptions import ClientError
+
+from config import config
+from predict.detections import filter_detections
+from utils.query import s3
+
+
+class DetectionCache(object):
+    """ Raw detections (before the confidence thresholds) of the keyframes
+        of a video with one model, so predicting on the video again can
+        replay them instead of running the model.
+
+        The detections are saved as columns (frame_num, x1, y1, x2, y2,
+        score, label) of a compressed .npz file, along with the numbers of
+        the frames the model was run on (some have no detections). The file
+        is kept in DETECTION_CACHE_FOLDER and the S3 detections folder.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.path = os.path.join(config.DETECTION_CACHE_FOLDER, filename)
+        # frame_num -> (boxes, scores, labels)
+        self.frames = {}
+        # whether there are detections that haven't been saved
+        self.changed = False
+
+    @classmethod
+    def for_video(cls, videoid, model_key):
+        """ The cache of a video for the model identified by model_key,
+            loaded from disk (or S3) if it was saved before
+        """
+        cache = cls(f'{videoid}_{model_key}.npz')
+        cache.load()
+        return cache
+
+    @classmethod
+    def from_file(cls, path):
+        """ A cache saved at path (anywhere on disk) """
+        cache = cls(os.path.basename(path))
+        cache.path = path
+        cache.load()
+        return cache
+
+    def __contains__(self, frame_num):
+        return frame_num in self.frames
+
+    def __len__(self):
+        return len(self.frames)
+
+    def empty_copy(self):
+        """ A cache for the same file without any detections, for recording
+            detections in another process
+        """
+        return DetectionCache(self.filename)
+
+    def add(self, frame_nums, boxes, scores, labels):
+        """ Adds the raw model output of a batch of frames, padding (label
+            -1) is dropped
+        """
+        for frame_num, frame_boxes, frame_scores, frame_labels in zip(
+                frame_nums, boxes, scores, labels):
+            valid = frame_labels != -1
+            self.frames[int(frame_num)] = (
+                np.asarray(frame_boxes[valid], dtype=np.float32),
+                np.asarray(frame_scores[valid], dtype=np.float32),
+                np.asarray(frame_labels[valid], dtype=np.int16))
+        self.changed = True
+
+    def every(self, num_frames):
+        """ A copy holding only the frames that are a multiple of
+            num_frames, the keyframes of predicting every num_frames frames
+        """
+        cache = self.empty_copy()
+        cache.path = self.path
+        cache.frames = {
+            frame_num: detections
+            for frame_num, detections in self.frames.items()
+            if frame_num % num_frames == 0}
+        return cache
+
+    def update(self, other):
+        self.frames.update(other.frames)
+        self.changed = self.changed or other.changed
+
+    def detect(self, frame_nums, frames):
+        """ Cached detections of frames, filtered like get_predictions.
+            Used in place of running the model, so frames is unused.
+        """
+        return [filter_detections(*self.frames[frame_num])
+                for frame_num in frame_nums]
+
+    def load(self):
+        if not os.path.exists(self.path) and not self._download():
+            return
+        # every access to a member of the file decompresses it again, so
+        # each one is read once
+        with np.load(self.path) as data:
+            frame_nums = data['frame_num']
+            boxes = np.stack(
+                [data['x1'], data['y1'], data['x2'], data['y2']], axis=1)
+            scores = data['score']
+            labels = data['label']
+            detected_frames = data['detected_frames']
+        # rows are sorted by frame, split them up into frames
+        splits = np.flatnonzero(np.diff(frame_nums)) + 1
+        for rows in np.split(np.arange(len(frame_nums)), splits):
+            if len(rows):
+                self.frames[int(frame_nums[rows[0]])] = (
+                    boxes[rows], scores[rows], labels[rows])
+        for frame_num in detected_frames:
+            self.frames.setdefault(
+                int(frame_num),
+                (np.zeros((0, 4), dtype=np.float32),
+                 np.zeros(0, dtype=np.float32),
+                 np.zeros(0, dtype=np.int16)))
+        print(f'Loaded cached detections of {len(self)} frames '
+              f'from {self.path}')
+
+    def save(self):
+        frame_nums = sorted(self.frames)
+        frames = [self.frames[frame_num] for frame_num in frame_nums]
+        boxes = np.concatenate(
+            [boxes for boxes, _, _ in frames] + [np.zeros((0, 4))])
+        os.makedirs(config.DETECTION_CACHE_FOLDER, exist_ok=True)
+        np.savez_compressed(
+            self.path,
+            frame_num=np.repeat(
+                np.array(frame_nums, dtype=np.int32),
+                [len(scores) for _, scores, _ in frames]),
+            x1=boxes[:, 0].astype(np.float32),
+            y1=boxes[:, 1].astype(np.float32),
+            x2=boxes[:, 2].astype(np.float32),
+            y2=boxes[:, 3].astype(np.float32),
+            score=np.concatenate(
+                [scores for _, scores, _ in frames] + [np.zeros(0)]
+            ).astype(np.float32),
+            label=np.concatenate(
+                [labels for _, _, labels in frames] + [np.zeros(0)]
+            ).astype(np.int16),
+            detected_frames=np.array(frame_nums, dtype=np.int32))
+        self.changed = False
+        if config.S3_DETECTIONS_FOLDER:
+            s3.upload_file(self.path, config.S3_BUCKET,
+                           config.S3_DETECTIONS_FOLDER + self.filename)
+        print(f'Saved detections of {len(self)} frames to {self.path}')
+
+    def _download(self):
+        if not config.S3_DETECTIONS_FOLDER:
+            return False
+        os.makedirs(config.DETECTION_CACHE_FOLDER, exist_ok=True)
+        try:
+            s3.download_file(config.S3_BUCKET,
+                             config.S3_DETECTIONS_FOLDER + self.filename,
+                             self.path)
+            return True
+        except ClientError:
+            return False
@@ -0,0 +1,104 @@
+import cv2
+import numpy as np
+
+from config import config
+from predict import matching
+
+
+class Detections(object):
+    """ The detections of a frame, as arrays: boxes (n x 4, x1 y1 x2 y2),
+        scores (n) and labels (n)
+    """
+
+    __slots__ = ('boxes', 'scores', 'labels')
+
+    def __init__(self, boxes, scores, labels):
+        self.boxes = boxes
+        self.scores = scores
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __getitem__(self, index):
+        """ The detections selected by an index array or mask """
+        return Detections(
+            self.boxes[index], self.scores[index], self.labels[index])
+
+    def detection(self, index):
+        """ A single detection as a (box, score, label) tuple """
+        return self.boxes[index], self.scores[index], self.labels[index]
+
+
+def run_model(frames, model, size=None):
+    """ Runs the model on a batch of frames (all the same size), resized to
+        size (width, height) if given. Returns the raw (boxes, scores,
+        labels) arrays of the batch, boxes in the coordinates of the frames.
+    """
+    height, width = frames[0].shape[:2]
+    box_scale = None
+    if size is not None and tuple(size) != (width, height):
+        frames = [cv2.resize(frame, tuple(size), interpolation=cv2.INTER_AREA)
+                  for frame in frames]
+        box_scale = np.array([width / size[0], height / size[1]] * 2)
+    boxes, scores, labels = model.predict_on_batch(np.stack(frames))
+    if box_scale is not None:
+        boxes = boxes * box_scale
+    return boxes, scores, labels
+
+
+def detection_mask(boxes, scores, labels):
+    """ Which detections are kept, for arrays of any batch shape: not
+        padding (label -1), a score of at least the confidence threshold of
+        their label and a valid box
+    """
+    thresholds = np.asarray(config.THRESHOLDS, dtype=np.float32)
+    labels = np.asarray(labels)
+    valid = labels >= 0
+    return (valid &
+            (scores >= thresholds[np.where(valid, labels, 0)]) &
+            (boxes[..., 0] <= boxes[..., 2]) &
+            (boxes[..., 1] <= boxes[..., 3]))
+
+
+def filter_batch(boxes, scores, labels):
+    """ The Detections of each frame of a batch of raw model output """
+    keep = detection_mask(boxes, scores, labels)
+    return [_suppress(Detections(
+                frame_boxes[frame_keep], frame_scores[frame_keep],
+                frame_labels[frame_keep]))
+            for frame_boxes, frame_scores, frame_labels, frame_keep in zip(
+                boxes, scores, labels, keep)]
+
+
+def filter_detections(boxes, scores, labels):
+    """ The Detections of the raw model output of a single frame """
+    return filter_batch(boxes[np.newaxis], scores[np.newaxis],
+                        labels[np.newaxis])[0]
+
+
+def _suppress(detections):
+    if not config.CROSS_CLASS_NMS_THRESHOLD or len(detections) < 2:
+        return detections
+    return detections[cross_class_nms(
+        detections.boxes, detections.scores,
+        config.CROSS_CLASS_NMS_THRESHOLD)]
+
+
+def cross_class_nms(boxes, scores, iou_thresh):
+    """ Non maximum suppression ignoring labels (the model only suppresses
+        boxes of the same class). Returns the indices of the kept boxes, the
+        highest scoring first.
+    """
+    order = np.argsort(-scores, kind='mergesort')
+    rank = np.empty(len(order), dtype=int)
+    rank[order] = np.arange(len(order))
+    rows, cols, _ = matching.iou_pairs(boxes, boxes, iou_thresh)
+    # a box can only suppress the lower scoring boxes it overlaps
+    lower = rank[cols] > rank[rows]
+    rows, cols = rows[lower], cols[lower]
+    suppressed = np.zeros(len(order), dtype=bool)
+    for index in order:
+        if not suppressed[index]:
+            suppressed[cols[rows == index]] = True
+    return order[~suppressed[order]]
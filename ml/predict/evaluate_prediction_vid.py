@@ -107,7 +107,7 @@ def get_counts(results, annotations):
 
 
 def evaluate(video_id, model_username, concepts, upload_annotations=False,
-             userid=None, create_collection=False):
+             userid=None, create_collection=False, model=None):
     # file format: (video_id)_(model_name)-(version).mp4
 
     if create_collection:
@@ -124,20 +124,24 @@ def evaluate(video_id, model_username, concepts, upload_annotations=False,
     print("ai video filename: {0}".format(filename))
     results, annotations = predict.predict_on_video(
         video_id, config.WEIGHTS_PATH, concepts, filename, upload_annotations,
-        userid, collection_id)
+        userid, collection_id, model)
     if (results.empty):
         return
-    username_split = model_username.split('-')
-    version = username_split[-1]
-    model_name = '-'.join(username_split[:-1])
-    # add the entry to ai_videos
-    cursor.execute('''
-        INSERT INTO ai_videos (name, videoid, version, model_name)
-        VALUES (%s, %s, %s, %s)''',
-                   (filename, video_id, version, model_name)
-                   )
-
-    con.commit()
+    if config.BURN_IN_VIDEO:
+        username_split = model_username.split('-')
+        version = username_split[-1]
+        model_name = '-'.join(username_split[:-1])
+        # add the entry to ai_videos
+        cursor.execute('''
+            INSERT INTO ai_videos (name, videoid, version, model_name)
+            VALUES (%s, %s, %s, %s)''',
+                       (filename, video_id, version, model_name)
+                       )
+        con.commit()
+    else:
+        # only the overlay track was uploaded, ai_videos lists videos the
+        # web client plays
+        print("no ai video to record, uploaded overlays instead")
     print("done predicting")
 
     metrics = score_predictions(
@@ -0,0 +1,139 @@
+import copy
+from collections import deque
+
+import cv2
+
+from config import config
+from predict.scheduling import make_thumbnail, cell_difference
+from utils.query import s3
+
+
+class VideoFrames(object):
+    """ Streams the resized frames of an S3 video on demand.
+
+        No frames are kept once they have been yielded, iterating the
+        object again re-opens the video from the start (or from the first
+        frame of the segment, see segment).
+    """
+
+    def __init__(self, vid_filename, local_path=None):
+        self.vid_filename = vid_filename
+        # read from this file instead of S3 if given
+        self.local_path = local_path
+        vid = self._open()
+        self.fps = vid.get(cv2.CAP_PROP_FPS)
+        self.length = int(vid.get(cv2.CAP_PROP_FRAME_COUNT))
+        # size of the source video, frames are resized when streamed
+        self.width = int(vid.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(vid.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        vid.release()
+        # frames [start, stop) are streamed, stop=None reads to the end
+        self.start = 0
+        self.stop = None
+
+    def segment(self, start, stop=None):
+        """ Returns a copy streaming only frames [start, stop) """
+        segment = copy.copy(self)
+        segment.start = start
+        segment.stop = stop
+        return segment
+
+    def _open(self):
+        if self.local_path is not None:
+            return cv2.VideoCapture(self.local_path)
+        # Presigned urls expire quickly, so every pass gets a fresh one
+        url = s3.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': config.S3_BUCKET,
+                    'Key': config.S3_VIDEO_FOLDER + self.vid_filename},
+            ExpiresIn=100)
+        vid = cv2.VideoCapture(url)
+        while not vid.isOpened():
+            continue
+        return vid
+
+    def __len__(self):
+        stop = self.length if self.stop is None else self.stop
+        return stop - self.start
+
+    def __iter__(self):
+        for frame, _, _ in self.stream():
+            yield frame
+
+    def stream(self, skip_static=False, scheduler=None):
+        """ Yields (frame, static, keyframe) triples. keyframe is whether
+            scheduler (see predict.scheduling) picks the frame, it sees
+            every decoded frame. With skip_static, frames nearly the same as
+            the last frame that wasn't skipped (see cell_difference) aren't
+            resized, that frame is yielded again with static set instead.
+            Keyframes are never skipped, so the model always gets the real
+            frame.
+        """
+        skip_static = skip_static and config.STATIC_FRAME_THRESHOLD > 0
+        vid = self._open()
+        if self.start:
+            vid.set(cv2.CAP_PROP_POS_FRAMES, self.start)
+        frame_num = self.start
+        resized = None
+        last_thumbnail = None
+        try:
+            while self.stop is None or frame_num < self.stop:
+                check, frame = vid.read()
+                if not check:
+                    break
+                keyframe = (scheduler is not None and
+                            scheduler.is_keyframe(frame_num, frame))
+                frame_num += 1
+                if skip_static:
+                    thumbnail = make_thumbnail(frame)
+                    if (not keyframe and last_thumbnail is not None and
+                            cell_difference(thumbnail, last_thumbnail) <
+                            config.STATIC_FRAME_THRESHOLD):
+                        yield resized, True, False
+                        continue
+                    last_thumbnail = thumbnail
+                resized = cv2.resize(
+                    frame, (config.RESIZED_WIDTH, config.RESIZED_HEIGHT))
+                yield resized, False, keyframe
+        finally:
+            vid.release()
+
+    def select(self, frame_nums):
+        """ Streams the video once, yielding (frame_num, frame) for only the
+            requested frames. Nothing is kept, so use each frame before
+            asking for the next.
+        """
+        frame_nums = set(frame_nums)
+        if not frame_nums:
+            return
+        last = max(frame_nums)
+        for frame_num, frame in enumerate(self, self.start):
+            if frame_num in frame_nums:
+                yield frame_num, frame
+            if frame_num >= last:
+                break
+
+
+class FrameBuffer(object):
+    """ Ring buffer of the most recently tracked frames, indexed by frame
+        number. Frames must be appended in order.
+    """
+
+    def __init__(self, size, first=0):
+        self.frames = deque(maxlen=size)
+        # frame number of the oldest frame held in the buffer
+        self.first = first
+
+    def append(self, frame):
+        if len(self.frames) == self.frames.maxlen:
+            self.first += 1
+        self.frames.append(frame)
+
+    def __getitem__(self, frame_num):
+        """ Frames that have fallen out of the buffer raise an IndexError """
+        index = frame_num - self.first
+        if index < 0 or index >= len(self.frames):
+            raise IndexError(
+                f'frame {frame_num} is not buffered (holding '
+                f'{self.first}-{self.first + len(self.frames) - 1})')
+        return self.frames[index]
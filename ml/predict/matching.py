@@ -0,0 +1,147 @@
+import numpy as np
+
+# Above this many box pairs, candidates are found with a spatial grid
+# instead of computing the full IOU matrix
+GRID_MIN_PAIRS = 4096
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """ Pairwise IOU of two lists of (x1, y1, x2, y2) boxes, computed the same
+        way as predict.compute_IOU. Returns a len(boxes_a) x len(boxes_b) array
+    """
+    a = _as_boxes(boxes_a)
+    b = _as_boxes(boxes_b)
+    # +1 in computations are to account for pixel indexing
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1]) + 1
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1]) + 1
+    intersect_width = (np.minimum(a[:, None, 2], b[None, :, 2]) -
+                       np.maximum(a[:, None, 0], b[None, :, 0]) + 1)
+    intersect_height = (np.minimum(a[:, None, 3], b[None, :, 3]) -
+                        np.maximum(a[:, None, 1], b[None, :, 1]) + 1)
+    # check for zero overlap
+    intersection = (np.maximum(0, intersect_width) *
+                    np.maximum(0, intersect_height))
+    return intersection / (area_a[:, None] + area_b[None, :] - intersection)
+
+
+def iou_pairs(boxes_a, boxes_b, iou_thresh):
+    """ Finds every pair of boxes with an IOU of at least iou_thresh (> 0)
+        Returns the (rows, cols, ious) of those pairs
+    """
+    a = _as_boxes(boxes_a)
+    b = _as_boxes(boxes_b)
+    if len(a) * len(b) <= GRID_MIN_PAIRS:
+        ious = iou_matrix(a, b)
+        rows, cols = np.nonzero(ious >= iou_thresh)
+        return rows, cols, ious[rows, cols]
+
+    rows, cols = _grid_candidates(a, b)
+    if len(rows) == 0:
+        return rows, cols, np.zeros(0)
+    ious = paired_iou(a[rows], b[cols])
+    keep = ious >= iou_thresh
+    return rows[keep], cols[keep], ious[keep]
+
+
+def match_boxes(boxes_a, boxes_b, iou_thresh):
+    """ One-to-one assignment of boxes_a to boxes_b, greedily taking the
+        pairs with the highest IOU first (ties go to the lowest indices).
+        Returns an array with the matched index in boxes_b for each box in
+        boxes_a, or -1 if it has no match of at least iou_thresh.
+    """
+    matches = np.full(len(boxes_a), -1, dtype=int)
+    if len(boxes_a) == 0 or len(boxes_b) == 0:
+        return matches
+    rows, cols, ious = iou_pairs(boxes_a, boxes_b, iou_thresh)
+    matched_b = np.zeros(len(boxes_b), dtype=bool)
+    for index in np.lexsort((cols, rows, -ious)):
+        row, col = rows[index], cols[index]
+        if matches[row] == -1 and not matched_b[col]:
+            matches[row] = col
+            matched_b[col] = True
+    return matches
+
+
+def _as_boxes(boxes):
+    return np.asarray(boxes, dtype=float).reshape(-1, 4)
+
+
+def paired_iou(a, b):
+    """ IOU of a[i] with b[i] for every i """
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1]) + 1
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1]) + 1
+    intersect_width = np.maximum(
+        0, np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]) + 1)
+    intersect_height = np.maximum(
+        0, np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]) + 1)
+    intersection = intersect_width * intersect_height
+    return intersection / (area_a + area_b - intersection)
+
+
+def _grid_candidates(a, b):
+    """ Buckets the boxes of b into a uniform grid and pairs each box of a
+        with the boxes of b sharing a grid cell. Only boxes that overlap can
+        have an IOU above 0, so no matching pair is missed.
+    """
+    sizes = np.concatenate((a[:, 2:] - a[:, :2], b[:, 2:] - b[:, :2]))
+    cell_size = max(np.median(sizes), 16)
+
+    def cells(box):
+        # boxes overlapping by a single pixel still intersect (see +1 above)
+        x1, y1 = np.floor((box[:2] - 1) / cell_size).astype(int)
+        x2, y2 = np.floor((box[2:] + 1) / cell_size).astype(int)
+        return ((x, y) for x in range(x1, x2 + 1) for y in range(y1, y2 + 1))
+
+    grid = {}
+    for col, box in enumerate(b):
+        for cell in cells(box):
+            grid.setdefault(cell, []).append(col)
+
+    rows = []
+    cols = []
+    for row, box in enumerate(a):
+        candidates = set()
+        for cell in cells(box):
+            candidates.update(grid.get(cell, ()))
+        rows.extend([row] * len(candidates))
+        cols.extend(sorted(candidates))
+    return np.array(rows, dtype=int), np.array(cols, dtype=int)
+
+
+class FrameIndex(object):
+    """ Maps frame numbers to the boxes saved at that frame and the ids of
+        the objects they belong to, so finished tracks can be matched
+        against without searching through all of them.
+    """
+
+    def __init__(self):
+        # frame_num -> ([boxes], [objectids])
+        self.frames = {}
+        # every frame before this one has been pruned
+        self.first_frame = 0
+
+    def add(self, frame_nums, boxes, objectid):
+        for frame_num, box in zip(frame_nums, boxes):
+            if frame_num < self.first_frame:
+                continue
+            frame_boxes, frame_ids = self.frames.setdefault(
+                frame_num, ([], []))
+            frame_boxes.append(box)
+            frame_ids.append(objectid)
+
+    def match(self, frame_num, box, iou_thresh):
+        """ Returns the id of the object whose box at frame_num overlaps box
+            the most, or None if no IOU reaches iou_thresh
+        """
+        if frame_num not in self.frames:
+            return None
+        frame_boxes, frame_ids = self.frames[frame_num]
+        ious = iou_matrix([box], frame_boxes)[0]
+        best = np.argmax(ious)
+        return frame_ids[best] if ious[best] >= iou_thresh else None
+
+    def prune(self, first_frame):
+        """ Drops the frames before first_frame """
+        for frame_num in range(self.first_frame, first_frame):
+            self.frames.pop(frame_num, None)
+        self.first_frame = max(self.first_frame, first_frame)
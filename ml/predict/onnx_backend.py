@@ -0,0 +1,129 @@
+"""
+RetinaNet inference on ONNX Runtime, for prediction boxes without a GPU.
+
+The ONNX model is the training model (regression and classification
+outputs) exported from the Keras weights. Applying the regression to the
+anchors, clipping and non maximum suppression (the layers convert_model
+adds) are done here in numpy, the same way keras_retinanet does them.
+"""
+import os
+
+import cv2
+import numpy as np
+import onnxruntime
+import tensorflow as tf
+import tf2onnx
+from keras import backend as K
+from keras_retinanet.utils.anchors import anchors_for_shape
+
+# keras_retinanet's filter_detections defaults
+SCORE_THRESHOLD = 0.05
+NMS_THRESHOLD = 0.5
+MAX_DETECTIONS = 300
+# Normalization of the regression values used in training
+REGRESSION_STD = 0.2
+
+
+def export_onnx(model, onnx_path, opset=11):
+    """ Freezes a Keras training model and writes it out as an ONNX model.
+        The file is written under a temporary name and then renamed, so
+        other processes never open a partly written model.
+    """
+    session = K.get_session()
+    output_names = [output.op.name for output in model.outputs]
+    graph_def = tf.graph_util.convert_variables_to_constants(
+        session, session.graph.as_graph_def(), output_names)
+    graph_def = tf.graph_util.remove_training_nodes(graph_def)
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        onnx_graph = tf2onnx.tfonnx.process_tf_graph(
+            graph, opset=opset, input_names=[model.inputs[0].name],
+            output_names=[output.name for output in model.outputs])
+        onnx_graph = tf2onnx.optimizer.optimize_graph(onnx_graph)
+        onnx_model = onnx_graph.make_model('retinanet')
+    temp_path = f'{onnx_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(onnx_model.SerializeToString())
+    os.replace(temp_path, onnx_path)
+
+
+class OnnxRetinaNet(object):
+    """ Runs an exported RetinaNet on ONNX Runtime. predict_on_batch returns
+        the same (boxes, scores, labels) arrays as the converted Keras
+        model, so it can be used in place of one.
+    """
+
+    def __init__(self, onnx_path, threads=0):
+        options = onnxruntime.SessionOptions()
+        # 0 lets ONNX Runtime use every core
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(onnx_path, options)
+        self.input_name = self.session.get_inputs()[0].name
+        # anchors by image shape
+        self.anchors = {}
+
+    def predict_on_batch(self, frames):
+        frames = np.asarray(frames, dtype=np.float32)
+        regression, classification = self.session.run(
+            None, {self.input_name: frames})
+        height, width = frames.shape[1:3]
+        if (height, width) not in self.anchors:
+            self.anchors[height, width] = anchors_for_shape(frames.shape[1:])
+        boxes = regress_boxes(self.anchors[height, width], regression)
+        np.clip(boxes[..., 0::2], 0, width, out=boxes[..., 0::2])
+        np.clip(boxes[..., 1::2], 0, height, out=boxes[..., 1::2])
+
+        batch_boxes = np.full((len(frames), MAX_DETECTIONS, 4), -1,
+                              dtype=np.float32)
+        batch_scores = np.full((len(frames), MAX_DETECTIONS), -1,
+                               dtype=np.float32)
+        batch_labels = np.full((len(frames), MAX_DETECTIONS), -1,
+                               dtype=np.int64)
+        for index in range(len(frames)):
+            indices, labels = filter_detections(
+                boxes[index], classification[index])
+            count = len(indices)
+            batch_boxes[index, :count] = boxes[index, indices]
+            batch_scores[index, :count] = classification[
+                index, indices, labels]
+            batch_labels[index, :count] = labels
+        return batch_boxes, batch_scores, batch_labels
+
+
+def regress_boxes(anchors, regression):
+    """ Applies (batch, anchors, 4) regression values to the anchors """
+    widths = anchors[:, 2] - anchors[:, 0]
+    heights = anchors[:, 3] - anchors[:, 1]
+    scale = np.stack((widths, heights, widths, heights), axis=1)
+    return anchors + regression * REGRESSION_STD * scale
+
+
+def filter_detections(boxes, classification):
+    """ Per class score threshold and non maximum suppression, keeping the
+        MAX_DETECTIONS best scoring detections.
+        Returns the (box indices, labels) of the kept detections.
+    """
+    all_indices = []
+    all_labels = []
+    for label in range(classification.shape[1]):
+        scores = classification[:, label]
+        indices = np.flatnonzero(scores > SCORE_THRESHOLD)
+        if len(indices) == 0:
+            continue
+        candidates = boxes[indices]
+        # NMSBoxes takes (x, y, w, h) boxes
+        rects = np.concatenate(
+            (candidates[:, :2], candidates[:, 2:] - candidates[:, :2]),
+            axis=1)
+        kept = np.array(cv2.dnn.NMSBoxes(
+            rects.tolist(), scores[indices].tolist(), SCORE_THRESHOLD,
+            NMS_THRESHOLD, top_k=MAX_DETECTIONS), dtype=int).reshape(-1)
+        all_indices.append(indices[kept])
+        all_labels.append(np.full(len(kept), label, dtype=np.int64))
+    if not all_indices:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=np.int64)
+    indices = np.concatenate(all_indices)
+    labels = np.concatenate(all_labels)
+    best = np.argsort(-classification[indices, labels],
+                      kind='mergesort')[:MAX_DETECTIONS]
+    return indices[best], labels[best]
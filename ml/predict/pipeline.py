@@ -0,0 +1,65 @@
+import queue
+import threading
+
+from config import config
+
+# Marks the end of a stage's output
+_DONE = object()
+
+
+def stage(iterable, name):
+    """ Runs iterable as its own pipeline stage if pipelined prediction is
+        enabled, otherwise it's iterated in the calling thread
+    """
+    if not config.PIPELINED_PREDICTION:
+        return iter(iterable)
+    return threaded(iterable, config.PIPELINE_QUEUE_SIZE, name)
+
+
+def threaded(iterable, maxsize, name=None):
+    """ Iterates iterable in a background thread and yields its items through
+        a queue holding at most maxsize items. A full queue blocks the
+        background thread (backpressure), and exceptions raised while
+        iterating are re-raised in the consuming thread.
+    """
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if not _put(items, (True, item), stop):
+                    return
+            _put(items, (True, _DONE), stop)
+        except BaseException as e:
+            _put(items, (False, e), stop)
+        finally:
+            # Lets upstream stages shut down if we stopped early
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            success, item = items.get()
+            if not success:
+                raise item
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _put(items, item, stop):
+    """ Blocks until item is queued, returns False if the consumer stopped """
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
@@ -1,8 +1,15 @@
 import copy
+import hashlib
+import json
+import math
+from array import array
 import os
+import time
 import uuid
 import datetime
+import multiprocessing
 import psutil
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import numpy as np
@@ -12,13 +19,38 @@ from keras_retinanet.models import load_model
 import subprocess
 
 from config import config
+from predict.frames import VideoFrames, FrameBuffer
+from predict.pipeline import stage
+from predict import matching
+from predict import segments
+from predict.scheduling import KeyframeScheduler, FixedKeyframes
+from predict.detections import run_model, filter_batch
+from predict.detection_cache import DetectionCache
 from train.preprocessing.annotation_generator import get_classmap
 from utils.query import s3, cursor, pd_query, con
-from ffmpy import FFmpeg
+from utils.tracking_frames import make_tracking_frame, scale_box
+from utils.video_encoder import encode_video
+from utils.model_files import inference_path, has_inference_model,\
+    onnx_path, quantized_path, is_newer
 from memory_profiler import profile
 
 fp = open('memory_profiler.log', 'w+')
 
+# Converted models by (weights path, weights file hash), see init_model
+model_cache = {}
+
+# Model of a segment worker process, loaded once by _init_segment_worker
+segment_model = None
+
+# Whether upload_predict_progress writes the predict_progress row. Turned
+# off in evaluation workers, which would overwrite each other's progress.
+report_progress = True
+
+# OpenCV trackers release the GIL while updating, so the objects of a frame
+# are updated on this pool (reused for every video)
+tracking_pool = (ThreadPoolExecutor(config.TRACKING_THREADS)
+                 if config.TRACKING_THREADS > 1 else None)
+
 
 def get_classmap(concepts):
     classmap = []
@@ -35,15 +67,101 @@ def printing_with_time(text):
     print(text + " " + str(datetime.datetime.now()))
 
 
+class KalmanBoxTracker(object):
+    """ Motion-only tracker in the style of SORT. A constant velocity Kalman
+        filter on the box center and size predicts the box each frame without
+        looking at the frame, and detections correct it at keyframes.
+        Has the same init/update interface as the OpenCV trackers.
+    """
+
+    # transition: every state variable moves by its velocity each frame
+    transition = np.eye(8) + np.eye(8, k=4)
+    # we only measure the center and size of the box
+    measurement = np.eye(4, 8)
+    process_noise = np.diag([1, 1, 1, 1, 0.1, 0.1, 0.1, 0.1])
+    measurement_noise = np.diag([10, 10, 10, 10])
+
+    def __init__(self):
+        self.state = None
+        self.covariance = None
+        self.frame_size = None
+
+    def init(self, frame, box):
+        # box velocity is unknown until the first correction
+        self.state = np.concatenate((self._to_measurement(box), np.zeros(4)))
+        self.covariance = np.diag([10, 10, 10, 10, 1e3, 1e3, 1e3, 1e3])
+        self.frame_size = frame.shape[1::-1]
+        return True
+
+    def update(self, frame):
+        self.state = self.transition @ self.state
+        self.covariance = (self.transition @ self.covariance @
+                           self.transition.T + self.process_noise)
+        center_x, center_y, w, h = self.state[:4]
+        x1 = center_x - w / 2
+        y1 = center_y - h / 2
+        # Fail once the box collapses or leaves the frame
+        success = (
+            w >= 1 and h >= 1 and x1 + w > 0 and y1 + h > 0 and
+            x1 < self.frame_size[0] and y1 < self.frame_size[1])
+        return success, (x1, y1, w, h)
+
+    def correct(self, box):
+        residual = self._to_measurement(box) - self.measurement @ self.state
+        residual_covariance = (self.measurement @ self.covariance @
+                               self.measurement.T + self.measurement_noise)
+        gain = (self.covariance @ self.measurement.T @
+                np.linalg.inv(residual_covariance))
+        self.state = self.state + gain @ residual
+        self.covariance = (np.eye(8) - gain @ self.measurement) @ \
+            self.covariance
+
+    @staticmethod
+    def _to_measurement(box):
+        (x1, y1, w, h) = box
+        return np.array([x1 + w / 2, y1 + h / 2, w, h], dtype=float)
+
+
+def _opencv_tracker(name):
+    # Newer OpenCV builds moved some of the trackers into cv2.legacy
+    create = getattr(cv2, name, None) or getattr(cv2.legacy, name)
+    return create()
+
+
+# The trackers objects can be tracked with between keyframes,
+# selected with "prediction_tracker" in the config
+TRACKER_BACKENDS = {
+    "kcf": lambda: _opencv_tracker('TrackerKCF_create'),
+    "mosse": lambda: _opencv_tracker('TrackerMOSSE_create'),
+    "csrt": lambda: _opencv_tracker('TrackerCSRT_create'),
+    "kalman": KalmanBoxTracker,
+}
+
+
+def create_tracker():
+    return TRACKER_BACKENDS[config.PREDICTION_TRACKER]()
+
+
+ANNOTATION_COLUMNS = [
+    'x1', 'y1', 'x2', 'y2', 'label', 'confidence', 'objectid', 'frame_num',
+    'skipped']
+
+
 class Tracked_object(object):
+    """ A predicted object, tracked from frame to frame. Its annotations are
+        kept in growable array columns (one row per tracked frame) and are
+        only turned into a DataFrame by tracks_to_dataframe.
+    """
+
+    __slots__ = ('id', 'x1', 'y1', 'x2', 'y2', 'box', 'tracker',
+                 'tracked_frames', 'columns', 'frame_nums', 'skipped')
 
     def __init__(self, detection, frame, frame_num):
-        self.annotations = pd.DataFrame(
-            columns=[
-                'x1', 'y1', 'x2', 'y2',
-                'label', 'confidence', 'objectid', 'frame_num'
-            ]
-        )
+        # x1, y1, x2, y2, label, confidence (nan when there is no label)
+        self.columns = [array('d') for _ in range(6)]
+        self.frame_nums = array('q')
+        # whether the box was copied from the previous (static) frame
+        self.skipped = array('b')
         (x1, y1, x2, y2) = detection[0]
         self.id = uuid.uuid4()
         self.x1 = x1
@@ -51,25 +169,44 @@ class Tracked_object(object):
         self.y1 = y1
         self.y2 = y2
         self.box = (x1, y1, (x2 - x1), (y2 - y1))
-        self.tracker = cv2.TrackerKCF_create()
-        self.tracker.init(frame, self.box)
+        self.tracker = None
+        self.start_tracker(frame)
         label = detection[2]
         confidence = detection[1]
         self.save_annotation(frame_num, label=label, confidence=confidence)
         self.tracked_frames = 0
 
-    def save_annotation(self, frame_num, label=None, confidence=None):
-        annotation = {}
-        annotation['x1'] = self.x1
-        annotation['y1'] = self.y1
-        annotation['x2'] = self.x2
-        annotation['y2'] = self.y2
-        annotation['label'] = label
-        annotation['confidence'] = confidence
-        annotation['objectid'] = self.id
-        annotation['frame_num'] = frame_num
-        self.annotations = self.annotations.append(
-            annotation, ignore_index=True)
+    def start_tracker(self, frame):
+        """ (Re)starts tracking self.box, frame is a tracking frame """
+        box = scale_box(self.box, config.TRACKING_FRAME_SCALE)
+        if isinstance(self.tracker, KalmanBoxTracker):
+            # Keep the estimated velocity, the detection only corrects it
+            self.tracker.correct(box)
+        else:
+            self.tracker = create_tracker()
+            self.tracker.init(frame, box)
+
+    def save_annotation(self, frame_num, label=None, confidence=None,
+                        skipped=False):
+        self.add_annotation(
+            self.x1, self.y1, self.x2, self.y2, frame_num, label, confidence,
+            skipped)
+
+    def add_annotation(self, x1, y1, x2, y2, frame_num,
+                       label=None, confidence=None, skipped=False):
+        row = (x1, y1, x2, y2,
+               np.nan if label is None else label,
+               np.nan if confidence is None else confidence)
+        for column, value in zip(self.columns, row):
+            column.append(value)
+        self.frame_nums.append(int(frame_num))
+        self.skipped.append(skipped)
+
+    def remove_last_annotation(self):
+        for column in self.columns:
+            column.pop()
+        self.frame_nums.pop()
+        self.skipped.pop()
 
     def reinit(self, detection, frame, frame_num):
         (x1, y1, x2, y2) = detection[0]
@@ -78,16 +215,16 @@ class Tracked_object(object):
         self.y1 = y1
         self.y2 = y2
         self.box = (x1, y1, (x2 - x1), (y2 - y1))
-        self.tracker = cv2.TrackerKCF_create()
-        self.tracker.init(frame, self.box)
+        self.start_tracker(frame)
         label = detection[2]
         confidence = detection[1]
-        self.annotations = self.annotations[:-1]
+        self.remove_last_annotation()
         self.save_annotation(frame_num, label=label, confidence=confidence)
         self.tracked_frames = 0
 
     def update(self, frame, frame_num):
         success, box = self.tracker.update(frame)
+        box = scale_box(box, 1 / config.TRACKING_FRAME_SCALE)
         (x1, y1, w, h) = [int(v) for v in box]
         if success:
             self.x1 = x1
@@ -99,9 +236,50 @@ class Tracked_object(object):
             self.tracked_frames += 1
         return success
 
+    def skip(self, frame_num):
+        """ Keeps the last box for a frame that didn't change """
+        self.save_annotation(frame_num, skipped=True)
+        self.tracked_frames += 1
+        return True
+
     def change_id(self, matched_obj_id):
         self.id = matched_obj_id
-        self.annotations['objectid'] = matched_obj_id
+
+    def boxes(self):
+        """ Returns the (x1, y1, x2, y2) box of every annotation """
+        return np.column_stack([
+            np.frombuffer(column, dtype=np.float64)
+            for column in self.columns[:4]])
+
+    def __len__(self):
+        return len(self.frame_nums)
+
+
+def tracks_to_dataframe(tracked_objects):
+    """ Builds a single DataFrame holding the annotations of all the objects """
+    if not tracked_objects:
+        return pd.DataFrame(columns=ANNOTATION_COLUMNS)
+    columns = [
+        np.concatenate([
+            np.frombuffer(obj.columns[index], dtype=np.float64)
+            for obj in tracked_objects])
+        for index in range(6)]
+    objectids = np.empty(sum(len(obj) for obj in tracked_objects),
+                         dtype=object)
+    start = 0
+    for obj in tracked_objects:
+        objectids[start:start + len(obj)] = obj.id
+        start += len(obj)
+    frame_nums = np.concatenate([
+        np.frombuffer(obj.frame_nums, dtype=np.int64)
+        for obj in tracked_objects])
+    skipped = np.concatenate([
+        np.frombuffer(obj.skipped, dtype=np.int8)
+        for obj in tracked_objects]).astype(bool)
+    return pd.DataFrame(
+        dict(zip(ANNOTATION_COLUMNS,
+                 columns + [objectids, frame_nums, skipped])),
+        columns=ANNOTATION_COLUMNS)
 
 
 def resize(row):
@@ -118,17 +296,82 @@ def resize(row):
 
 @profile(stream=fp)
 def predict_on_video(videoid, model_weights, concepts, filename,
-                     upload_annotations=False, userid=None, collection_id=None):
+                     upload_annotations=False, userid=None, collection_id=None,
+                     model=None):
+    '''
+    model is loaded from model_weights unless an already loaded model is
+    given (by a worker predicting on several videos)
+    '''
 
     vid_filename = pd_query(f'''
             SELECT *
             FROM videos
             WHERE id ={videoid}''').iloc[0].filename
-    print("Loading Video.")
-    frames, fps = get_video_frames(vid_filename, videoid)
+    print("Opening Video.")
+    frames = VideoFrames(vid_filename)
+    fps = frames.fps
 
     # Get biologist annotations for video
+    annotations = get_annotations(videoid, concepts, fps)
+
+    cache = None
+    if config.DETECTION_CACHE:
+        # Detections of a previous run with the same model are replayed
+        cache = DetectionCache.for_video(
+            videoid, detection_model_key(model_weights, frames))
+
+    printing_with_time("Predicting")
+    if model is None and config.PREDICTION_WORKERS > 1:
+        # every worker process loads its own model
+        results = predict_segments(frames, model_weights, videoid, cache)
+    else:
+        if model is None and not cache:
+            print("Initializing Model")
+            model = init_model(model_weights)
+        results = predict_frames(frames, fps, model, videoid, cache)
+    if cache is not None and cache.changed:
+        cache.save()
+    results.to_csv('results.csv')
+    if (results.empty):
+        print("no predictions")
+        return results, annotations
+    results = propagate_conceptids(results, concepts)
+    results = length_limit_objects(results, config.MIN_FRAMES_THRESH)
+    # interweb human annotations and predictions
+
+    if upload_annotations:
+        printing_with_time("Uploading annotations")
+        # filter results down to middle frames
+        mid_frame_results = get_final_predictions(results)
+        mid_frames = dict(list(mid_frame_results.groupby(
+            mid_frame_results.frame_num.astype('int'))))
+        # upload these annotations as their frames stream past, only one
+        # frame is held at a time
+        for frame_num, frame in frames.select(mid_frames):
+            mid_frames[frame_num].apply(
+                lambda prediction: handle_annotation(
+                    prediction, frame, videoid, config.RESIZED_HEIGHT,
+                    config.RESIZED_WIDTH, userid, fps, collection_id), axis=1)
+        con.commit()
+
+    if config.BURN_IN_VIDEO:
+        printing_with_time("Generating Video")
+        generate_video(
+            filename, frames,
+            fps, results, concepts, videoid, annotations)
+    else:
+        printing_with_time("Generating Overlays")
+        generate_overlays(filename, fps, results, concepts, annotations)
+
+    printing_with_time("Done generating")
+    return results, annotations
 
+
+def get_annotations(videoid, concepts, fps):
+    '''
+    Biologist annotations of the concepts in a video, resized to the
+    resized frames
+    '''
     printing_with_time("Before database query")
     tuple_concept = ''
     if len(concepts) == 1:
@@ -159,163 +402,456 @@ def predict_on_video(videoid, model_weights, concepts, filename,
     annotations = annotations.apply(resize, axis=1)
     annotations = annotations.drop(['videowidth', 'videoheight'], axis=1)
     printing_with_time("Done resizing annotations.")
+    return annotations
 
-    print("Initializing Model")
-    model = init_model(model_weights)
 
-    printing_with_time("Predicting")
-    results, frames = predict_frames(frames, fps, model, videoid)
-    if (results.empty):
-        print("no predictions")
-        return results, annotations
-    results = propagate_conceptids(results, concepts)
-    results = length_limit_objects(results, config.MIN_FRAMES_THRESH)
-    # interweb human annotations and predictions
+def init_model(model_path, backend=None):
+    '''
+    Returns a model for the weights at model_path, ready to predict with
+    predict_on_batch. backend (INFERENCE_BACKEND by default) is either
+    'keras', the converted inference model (the one saved with the weights
+    when there is one, otherwise the weights are converted), 'onnx', the
+    model exported to ONNX (exported the first time) run on ONNX Runtime,
+    or 'onnx_int8', the INT8 quantized ONNX model made after training (see
+    predict.quantize). Models are cached for the life of the process, a
+    model is only loaded again if its file changed.
+    '''
+    model_path = os.path.abspath(model_path)
+    requested = backend or config.INFERENCE_BACKEND
+    backend = inference_backend(model_path, requested)
+    if backend != requested:
+        print(f'No quantized model for {model_path}, using the float model')
+    if backend == 'onnx_int8':
+        return cached_model(quantized_path(model_path), load_onnx_model)
+    if backend == 'onnx':
+        prepare_model(model_path, backend)
+        return cached_model(onnx_path(model_path), load_onnx_model)
+    if backend != 'keras':
+        raise ValueError(f'unknown inference backend: {backend}')
+    if has_inference_model(model_path):
+        return cached_model(inference_path(model_path), load_keras_model)
+    return cached_model(
+        model_path, lambda path: load_keras_model(path, convert=True))
+
+
+def prepare_model(model_path, backend=None):
+    '''
+    Exports the weights to ONNX if init_model will run them on the 'onnx'
+    backend and they haven't been yet. Called before starting worker
+    processes, so they don't all export the same file at once.
+    '''
+    model_path = os.path.abspath(model_path)
+    if inference_backend(model_path, backend) != 'onnx':
+        return
+    if is_newer(onnx_path(model_path), model_path):
+        return
+    # only needed (and installed) for the onnx backends
+    from predict import onnx_backend
+    print(f'Exporting {model_path} to ONNX')
+    onnx_backend.export_onnx(
+        load_model(model_path, backbone_name='resnet50'),
+        onnx_path(model_path))
 
-    if upload_annotations:
-        printing_with_time("Uploading annotations")
-        # filter results down to middle frames
-        mid_frame_results = get_final_predictions(results)
-        # upload these annotations
-        mid_frame_results.apply(
-            lambda prediction: handle_annotation(prediction, frames, videoid,
-                                                 config.RESIZED_HEIGHT,
-                                                 config.RESIZED_WIDTH, userid,
-                                                 fps, collection_id), axis=1)
-        con.commit()
 
-    printing_with_time("Generating Video")
-    generate_video(
-        filename, frames,
-        fps, results, concepts, videoid, annotations)
+def inference_backend(model_path, backend=None):
+    '''
+    The backend init_model runs the model on: backend (INFERENCE_BACKEND by
+    default), except that 'onnx_int8' falls back to 'onnx' while there is
+    no quantized model as new as the weights. It needs calibration data,
+    so it can't be made when loading the model.
+    '''
+    backend = backend or config.INFERENCE_BACKEND
+    if (backend == 'onnx_int8' and
+            not is_newer(quantized_path(model_path), model_path)):
+        return 'onnx'
+    return backend
 
-    printing_with_time("Done generating")
-    return results, annotations
 
+def cached_model(path, load):
+    '''
+    Returns the model loaded from path by load(path), from the cache if the
+    file hasn't changed since it was loaded
+    '''
+    key = (path, file_hash(path))
+    if key in model_cache:
+        print(f'Using cached model for {path}')
+        return model_cache[key]
+    # Weights are downloaded to the same path, older models are stale
+    for cached_key in list(model_cache):
+        if cached_key[0] == path:
+            del model_cache[cached_key]
+    model = load(path)
+    model_cache[key] = model
+    return model
 
-@profile(stream=fp)
-def get_video_frames(vid_filename, videoid):
-    frames = []
-    # grab video stream
-    url = s3.generate_presigned_url('get_object',
-                                    Params={'Bucket': config.S3_BUCKET,
-                                            'Key': config.S3_VIDEO_FOLDER + vid_filename},
-                                    ExpiresIn=100)
-    vid = cv2.VideoCapture(url)
-    fps = vid.get(cv2.CAP_PROP_FPS)
-    length = int(vid.get(cv2.CAP_PROP_FRAME_COUNT))
-    while not vid.isOpened():
-        continue
-    print("Successfully opened video.")
-    check = True
-    frame_counter = 0
-    one_percent_length = int(length / 100)
-    while True:
-        if frame_counter % one_percent_length == 0:
-            upload_predict_progress(frame_counter, videoid, length, 1)
-
-        check, frame = vid.read()
-        if not check:
-            break
-        frame = cv2.resize(
-            frame, (config.RESIZED_WIDTH, config.RESIZED_HEIGHT))
-        frames.append(frame)
-        frame_counter += 1
-    vid.release()
-    print("Done resizing video.")
-    return frames, fps
-
-
-def init_model(model_path):
-    model = load_model(model_path, backbone_name='resnet50')
-    model = convert_model(model)
+
+def load_keras_model(path, convert=False):
+    start = time.perf_counter()
+    model = load_model(path, backbone_name='resnet50')
+    loaded = time.perf_counter()
+    if convert:
+        model = convert_model(model)
+    converted = time.perf_counter()
+    # Build the predict function now, so the model can be used from the
+    # detector thread when predicting is pipelined
+    model._make_predict_function()
+    warm_up(model)
+    warmed_up = time.perf_counter()
+    print(f'Model loaded from {path} in {loaded - start:.2f}s, '
+          + (f'converted in {converted - loaded:.2f}s, ' if convert else '')
+          + f'warmed up in {warmed_up - converted:.2f}s')
+    return model
+
+
+def load_onnx_model(path):
+    from predict import onnx_backend
+    start = time.perf_counter()
+    model = onnx_backend.OnnxRetinaNet(path, config.ONNX_THREADS)
+    loaded = time.perf_counter()
+    warm_up(model)
+    print(f'ONNX model loaded from {path} in {loaded - start:.2f}s, '
+          f'warmed up in {time.perf_counter() - loaded:.2f}s')
     return model
 
 
-def predict_frames(video_frames, fps, model, videoid):
+def warm_up(model):
+    """ The first batch is slow (graph setup), get it out of the way """
+    model.predict_on_batch(np.zeros(
+        (1, config.RESIZED_HEIGHT, config.RESIZED_WIDTH, 3), dtype=np.uint8))
+
+
+def file_hash(path):
+    """ sha256 of a file, read in chunks """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def detection_model_key(model_path, video_frames):
+    '''
+    Identifies the raw detections a model makes on a video: the model file
+    init_model loads, the inference backend, the size the model is run on
+    and the keyframe schedule (only the cached keyframes are replayed)
+    '''
+    backend = inference_backend(model_path)
+    # the INT8 model also depends on its calibration, not only the weights
+    model_file = (quantized_path(model_path) if backend == 'onnx_int8'
+                  else model_path)
+    width, height = detector_size(video_frames.width, video_frames.height)
+    if config.ADAPTIVE_KEYFRAMES:
+        schedule = '-'.join(str(value) for value in [
+            config.MIN_FRAMES_BETWEEN_PREDICTIONS,
+            config.MAX_FRAMES_BETWEEN_PREDICTIONS,
+            *config.KEYFRAME_MOTION_THRESHOLDS])
+        schedule = f'adaptive{schedule}'
+    else:
+        schedule = f'every{config.NUM_FRAMES}'
+    return (f'{file_hash(model_file)[:16]}_{backend}_{width}x{height}_'
+            f'{schedule}')
+
+
+def predict_frames(video_frames, fps, model, videoid, cache=None):
+    '''
+    Detects and tracks objects over video_frames (a whole video or a
+    segment of one). Progress is only uploaded when videoid is given.
+    If cache (a DetectionCache) has detections, the model isn't run (and
+    may be None), the cached keyframes are replayed instead. Otherwise the
+    model's detections are added to it.
+    '''
     currently_tracked_objects = []
-    annotations = [
-        pd.DataFrame(
-            columns=[
-                'x1', 'y1', 'x2', 'y2',
-                'label', 'confidence', 'objectid', 'frame_num']
-        )]
+    finished_objects = []
+    # boxes of the finished objects by frame, for matching new objects to
+    backwards_frames = math.ceil(fps * config.MAX_TIME_BACK) + 1
+    finished_index = matching.FrameIndex()
+    # previous tracking frames kept around for tracking new objects backwards
+    frame_history = FrameBuffer(backwards_frames, video_frames.start)
     total_frames = len(video_frames)
-    one_percent_length = int(total_frames / 100)
-    for frame_num, frame in enumerate(video_frames):
-        if frame_num % one_percent_length == 0:
+    one_percent_length = max(1, int(total_frames / 100))
+    if cache:
+        scheduler = FixedKeyframes(cache.frames)
+        detect = cache.detect
+    else:
+        scheduler = KeyframeScheduler()
+        detect = model_detector(
+            model, detector_size(video_frames.width, video_frames.height),
+            cache)
+    # decoding and detection run ahead of tracking in their own threads
+    # the decoder picks the keyframes and flags frames that are nearly the
+    # same as the one before
+    keyframes = detect_keyframes(
+        stage(video_frames.stream(skip_static=True, scheduler=scheduler),
+              'decoder'),
+        detect, config.DETECTION_BATCH_SIZE, video_frames.start)
+    keyframes = with_tracking_frames(keyframes)
+    # trackers only ever see the (possibly downscaled) tracking frames
+    for frame_num, frame, static, detections in stage(keyframes, 'detector'):
+        frame_history.append(frame)
+        if videoid is not None and frame_num % one_percent_length == 0:
             # update the progress every 1% of the video
             upload_predict_progress(frame_num, videoid, total_frames, 2)
 
         # update tracking for currently tracked objects
-        for obj in currently_tracked_objects:
-            success = obj.update(frame, frame_num)
-            temp = list(currently_tracked_objects)
-            temp.remove(obj)
-            detection = (obj.box, 0, 0)
-            match, matched_object = does_match_existing_tracked_object(
-                detection[0], temp)
+        if static:
+            # Nothing moved, so reuse the boxes from the previous frame
+            successes = [
+                obj.skip(frame_num) for obj in currently_tracked_objects]
+        else:
+            successes = map_objects(
+                lambda obj: obj.update(frame, frame_num),
+                currently_tracked_objects)
+        still_tracked_objects = []
+        for obj, success in zip(currently_tracked_objects, successes):
             if not success or obj.tracked_frames > 30:
-                annotations.append(obj.annotations)
-                currently_tracked_objects.remove(obj)
+                finished_objects.append(obj)
+                finished_index.add(obj.frame_nums, obj.boxes(), obj.id)
                 # Check if there is a matching prediction if the tracking fails?
+            else:
+                still_tracked_objects.append(obj)
+        currently_tracked_objects = still_tracked_objects
 
-        # Every NUM_FRAMES frames, get new predictions
+        # Every few frames (see KeyframeScheduler) we have new predictions
         # Then, check if any detections match a currently tracked object
-        if frame_num % config.NUM_FRAMES == 0:
-            detections = get_predictions(frame, model)
-            print(f'total detections: {len(detections)}')
-            for detection in detections:
-                (x1, y1, x2, y2) = detection[0]
-                if (x1 > x2 or y1 > y2):
-                    continue
-                match, matched_object = does_match_existing_tracked_object(
-                    detection[0], currently_tracked_objects)
-                if match:
-                    matched_object.reinit(detection, frame, frame_num)
-                else:
-                    tracked_object = Tracked_object(
-                        detection, frame, frame_num)
-                    prev_annotations, matched_obj_id = track_backwards(
-                        video_frames, frame_num, detection, tracked_object.id, fps, pd.concat(annotations))
-                    if matched_obj_id:
-                        tracked_object.change_id(matched_obj_id)
-                    tracked_object.annotations = tracked_object.annotations.append(
-                        prev_annotations)
-                    currently_tracked_objects.append(tracked_object)
-
-    for obj in currently_tracked_objects:
-        annotations.append(obj.annotations)
-
-    results = pd.concat(annotations)
-    results.to_csv('results.csv')
-    return results, video_frames
+        if detections is not None:
+            # tracking backwards never goes further back than this
+            finished_index.prune(frame_num - backwards_frames)
+            currently_tracked_objects.extend(match_detections(
+                detections, currently_tracked_objects, frame, frame_num,
+                frame_history, fps, finished_index))
+
+    return tracks_to_dataframe(finished_objects + currently_tracked_objects)
+
+
+def predict_segments(video_frames, model_path, videoid, cache=None):
+    '''
+    Predicts on the segments of a video in PREDICTION_WORKERS processes, each
+    with its own model, and stitches the tracks of the segments together.
+    Detections are replayed from, or recorded into, cache like
+    predict_frames (no models are loaded when replaying).
+    '''
+    bounds = segments.segment_bounds(
+        len(video_frames), video_frames.fps, config.SEGMENT_SECONDS,
+        config.SEGMENT_OVERLAP_SECONDS)
+    total_frames = len(video_frames)
+    print(f'Predicting on {len(bounds)} segments with '
+          f'{config.PREDICTION_WORKERS} workers')
+    upload_predict_progress(0, videoid, total_frames, 2)
+    if cache is None or cache:
+        # the whole cache is replayed by every segment
+        segment_cache = cache
+    else:
+        # each segment records its detections, merged in here
+        segment_cache = cache.empty_copy()
+    jobs = [(video_frames.segment(start, stop), segment_cache)
+            for start, _, stop in bounds]
+    segment_results = []
+    if not cache:
+        prepare_model(model_path)
+    # Keras can't be used after a fork, so workers start fresh
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(min(config.PREDICTION_WORKERS, len(jobs)),
+                      initializer=_init_segment_worker,
+                      initargs=(None if cache else model_path,)) as pool:
+        for results, recorded in pool.imap(_predict_segment, jobs):
+            segment_results.append(results)
+            if recorded is not None:
+                cache.update(recorded)
+            done = len(segment_results)
+            upload_predict_progress(
+                bounds[done][1] if done < len(bounds) else total_frames,
+                videoid, total_frames, 2)
+    return segments.stitch_segments(segment_results, bounds)
+
+
+def _init_segment_worker(model_path):
+    global segment_model
+    if model_path is not None:
+        segment_model = init_model(model_path)
+
+
+def _predict_segment(job):
+    segment, cache = job
+    replaying = bool(cache)
+    results = predict_frames(segment, segment.fps, segment_model, None, cache)
+    # only send back the detections the segment recorded
+    return results, None if replaying else cache
+
+
+def map_objects(function, objects, pool=tracking_pool):
+    '''
+    Calls function on every object, on the tracking thread pool when there
+    is one. Returns the results in the same order as objects.
+    '''
+    if pool is None or len(objects) < 2:
+        return [function(obj) for obj in objects]
+    return list(pool.map(function, objects))
+
 
+def with_tracking_frames(keyframes):
+    """ Swaps the frames yielded by detect_keyframes for tracking frames """
+    tracking_frame = None
+    for frame_num, frame, static, detections in keyframes:
+        # static frames are the previous frame again
+        if not static or tracking_frame is None:
+            tracking_frame = make_tracking_frame(
+                frame, config.TRACKING_FRAME_SCALE)
+        yield frame_num, tracking_frame, static, detections
 
-def get_predictions(frame, model):
-    frame = np.expand_dims(frame, axis=0)
-    boxes, scores, labels = model.predict_on_batch(frame)
-    predictions = zip(boxes[0], scores[0], labels[0])
-    filtered_predictions = []
-    for box, score, label in predictions:
-        if config.THRESHOLDS[label] > score:
+
+def match_detections(detections, currently_tracked_objects, frame, frame_num,
+                     frame_history, fps, finished_index):
+    '''
+    Assigns each of the Detections to at most one tracked object (and vice
+    versa), reinitializing the matched objects. Unmatched detections that
+    still overlap a tracked object, or a new object from an earlier
+    detection, are duplicates and are dropped. The rest become new tracked
+    objects, which are tracked backwards and returned.
+    '''
+    detection_boxes = detections.boxes
+    tracked_boxes = [
+        (obj.x1, obj.y1, obj.x2, obj.y2) for obj in currently_tracked_objects]
+    matches = matching.match_boxes(
+        detection_boxes, tracked_boxes, config.TRACKING_IOU_THRESH)
+    unmatched = np.flatnonzero(matches == -1)
+    unmatched_boxes = detection_boxes[unmatched]
+
+    # Unmatched detections overlapping a tracked object
+    duplicates = set(matching.iou_pairs(
+        unmatched_boxes, tracked_boxes, config.TRACKING_IOU_THRESH)[0])
+    # Unmatched detections overlapping each other
+    overlapping = {}
+    rows, cols, _ = matching.iou_pairs(
+        unmatched_boxes, unmatched_boxes, config.TRACKING_IOU_THRESH)
+    for row, col in zip(rows, cols):
+        overlapping.setdefault(row, set()).add(col)
+
+    for index in np.flatnonzero(matches != -1):
+        currently_tracked_objects[matches[index]].reinit(
+            detections.detection(index), frame, frame_num)
+
+    new_detections = []
+    new_indices = set()
+    for index, detection_index in enumerate(unmatched):
+        if index in duplicates or overlapping.get(index, set()) & new_indices:
+            continue
+        new_detections.append(detections.detection(detection_index))
+        new_indices.add(index)
+
+    # All the new objects are tracked backwards in a single pass
+    new_objects = []
+    backwards = track_backwards(
+        frame_history, frame_num, new_detections, fps, finished_index)
+    for detection, (prev_annotations, matched_obj_id) in zip(
+            new_detections, backwards):
+        tracked_object = Tracked_object(detection, frame, frame_num)
+        if matched_obj_id:
+            tracked_object.change_id(matched_obj_id)
+        for annotation in prev_annotations:
+            tracked_object.add_annotation(*annotation)
+        new_objects.append(tracked_object)
+    return new_objects
+
+
+def detect_keyframes(video_frames, detect, batch_size, first_frame=0):
+    '''
+    Detects objects on the keyframes, batch_size keyframes at a time, with
+    detect(frame_nums, frames) (see model_detector). video_frames yields
+    (frame, static, keyframe) triples (see VideoFrames.stream), and this
+    yields (frame_num, frame, static, detections) for every frame in order.
+    detections is None for frames that aren't keyframes.
+
+    Frames are held back until their batch has been run, so at most
+    (batch_size - 1) * (max keyframe interval) + 1 frames are buffered here.
+    '''
+    pending = []
+    keyframes = []
+    detection_time = 0
+    detected_frames = 0
+    for frame_num, (frame, static, keyframe) in enumerate(
+            video_frames, first_frame):
+        if keyframe:
+            keyframes.append(len(pending))
+        pending.append((frame_num, frame, static))
+        if len(keyframes) < batch_size:
             continue
-        filtered_predictions.append((box, score, label))
-    return filtered_predictions
+        detection_time += _run_keyframe_batch(pending, keyframes, detect)
+        detected_frames += len(keyframes)
+        yield from pending
+        pending = []
+        keyframes = []
+    detection_time += _run_keyframe_batch(pending, keyframes, detect)
+    detected_frames += len(keyframes)
+    yield from pending
+    if detection_time:
+        print(f'Detection: {detected_frames} keyframes in '
+              f'{detection_time:.2f}s '
+              f'({detected_frames / detection_time:.2f} frames/sec)')
+
+
+def _run_keyframe_batch(pending, keyframes, detect):
+    """ Runs the keyframes of pending through detect in a single batch,
+        adding the detections (or None) to the end of each pending entry.
+        Returns the time spent detecting.
+    """
+    for index, entry in enumerate(pending):
+        pending[index] = entry + (None,)
+    if not keyframes:
+        return 0
+
+    start = time.perf_counter()
+    batch_detections = detect(
+        [pending[index][0] for index in keyframes],
+        [pending[index][1] for index in keyframes])
+    run_time = time.perf_counter() - start
+    print(f'batch of {len(keyframes)} keyframes: '
+          f'{sum(len(d) for d in batch_detections)} detections, '
+          f'{len(keyframes) / run_time:.2f} frames/sec')
+    for index, detections in zip(keyframes, batch_detections):
+        pending[index] = pending[index][:-1] + (detections,)
+    return run_time
+
+
+def detector_size(width, height):
+    '''
+    Size (width, height) the model is run on for a source video of the
+    given size: scaled so the shorter side is at most DETECTOR_MIN_SIDE and
+    the longer side at most DETECTOR_MAX_SIDE. Sources smaller than that
+    are kept at their own size rather than upscaled (and the detector never
+    gets more pixels than the resized frames have). A DETECTOR_MIN_SIDE of
+    0 runs the model on the resized frames.
+    '''
+    if not config.DETECTOR_MIN_SIDE or not width or not height:
+        return config.RESIZED_WIDTH, config.RESIZED_HEIGHT
+    scale = min(config.DETECTOR_MIN_SIDE / min(width, height),
+                config.DETECTOR_MAX_SIDE / max(width, height),
+                config.RESIZED_WIDTH / width,
+                config.RESIZED_HEIGHT / height,
+                1)
+    return round(width * scale), round(height * scale)
+
+
+def get_predictions(frames, model, size=None):
+    '''
+    Runs the model on a batch of frames (all the same size), resized to size
+    (width, height) if given. Boxes are in the coordinates of the frames.
+    Returns the filtered Detections of each frame
+    '''
+    return filter_batch(*run_model(frames, model, size))
 
 
-def does_match_existing_tracked_object(detection, currently_tracked_objects):
-    (x1, y1, x2, y2) = detection
-    detection_series = pd.Series({'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2})
-    # Compute IOU with each currently tracked object
-    max_iou = 0
-    match = None
-    for obj in currently_tracked_objects:
-        iou = compute_IOU(obj, detection_series)
-        if (iou > max_iou):
-            max_iou = iou
-            match = obj
-    return (max_iou >= config.TRACKING_IOU_THRESH), match
+def model_detector(model, size, cache=None):
+    '''
+    Returns a detect(frame_nums, frames) function for detect_keyframes that
+    runs the model (see get_predictions), adding the raw detections to
+    cache if given
+    '''
+    def detect(frame_nums, frames):
+        boxes, scores, labels = run_model(frames, model, size)
+        if cache is not None:
+            cache.add(frame_nums, boxes, scores, labels)
+        return filter_batch(boxes, scores, labels)
+    return detect
 
 
 def compute_IOU(A, B):
@@ -334,62 +870,77 @@ def compute_IOU(A, B):
 # skipping original frame annotation, already saved in object initialization
 
 
-def track_backwards(video_frames, frame_num, detection, object_id, fps, old_annotations):
-    annotations = pd.DataFrame(
-        columns=['x1', 'y1', 'x2', 'y2', 'label', 'confidence', 'objectid', 'frame_num'])
-    (x1, y1, x2, y2) = detection[0]
-    box = (x1, y1, (x2 - x1), (y2 - y1))
+def track_backwards(video_frames, frame_num, detections, fps, finished_index):
+    '''
+    Tracks every detection backwards from frame_num, walking the previous
+    frames (of the FrameBuffer video_frames) once for all of them. Each one stops on its own when its tracker
+    fails or it matches a finished object.
+
+    Returns an (annotations, matched_obj_id) pair for each detection, where
+    annotations are the (x1, y1, x2, y2, frame_num) boxes before frame_num
+    and matched_obj_id is the id of the matched object (or None)
+    '''
+    scale = config.TRACKING_FRAME_SCALE
     frame = video_frames[frame_num]
-    tracker = cv2.TrackerKCF_create()
-    tracker.init(frame, box)
-    success, box = tracker.update(frame)
+    tracks = []
+    for detection in detections:
+        (x1, y1, x2, y2) = detection[0]
+        box = (x1, y1, (x2 - x1), (y2 - y1))
+        tracker = create_tracker()
+        tracker.init(frame, scale_box(box, scale))
+        success, _ = tracker.update(frame)
+        tracks.append(_BackwardsTrack(tracker, success))
+
+    active = [track for track in tracks if track.active]
     frames = 0
     max_frames = fps * config.MAX_TIME_BACK
-    while success and frames < max_frames and frame_num > 0:
+    # stops at the oldest buffered frame, the first frame of the video (or
+    # of the segment) until the buffer fills up
+    while active and frames < max_frames and frame_num > video_frames.first:
         frame_num -= 1
         frame = video_frames[frame_num]
-        success, box = tracker.update(frame)
-        if success:
-            annotation = make_annotation(box, object_id, frame_num)
-            prev_frame_annotations = old_annotations[old_annotations['frame_num'] == frame_num]
-            matched_obj_id = match_old_annotations(
-                prev_frame_annotations, pd.Series(annotation))
-            if matched_obj_id:
-                annotations['objectid'] = matched_obj_id
-                return annotations, matched_obj_id
-
-            annotations = annotations.append(annotation, ignore_index=True)
-            frames += 1
-    return annotations, None
-
-
-def match_old_annotations(old_annotations, annotation):
-    max_iou = 0
-    match = None
-    for _, annot in old_annotations.iterrows():
-        iou = compute_IOU(annot, annotation)
-        if (iou > max_iou):
-            max_iou = iou
-            match = annot['objectid']
-    return match if (max_iou >= config.TRACKING_IOU_THRESH) else None
-
-
-def make_annotation(box, object_id, frame_num):
-    (x1, y1, w, h) = [int(v) for v in box]
-    x1 = x1
-    x2 = x1 + w
-    y1 = y1
-    y2 = y1 + h
-    annotation = {}
-    annotation['x1'] = x1
-    annotation['y1'] = y1
-    annotation['x2'] = x2
-    annotation['y2'] = y2
-    annotation['label'] = None
-    annotation['confidence'] = None
-    annotation['objectid'] = object_id
-    annotation['frame_num'] = frame_num
-    return annotation
+        map_objects(
+            lambda track: track.step(frame, frame_num, scale, finished_index),
+            active)
+        active = [track for track in active if track.active]
+        frames += 1
+    return [track.result() for track in tracks]
+
+
+class _BackwardsTrack(object):
+    """ A new object being tracked backwards by track_backwards """
+
+    __slots__ = ('tracker', 'active', 'annotations', 'matched_obj_id')
+
+    def __init__(self, tracker, active):
+        self.tracker = tracker
+        self.active = active
+        self.annotations = []
+        self.matched_obj_id = None
+
+    def step(self, frame, frame_num, scale, finished_index):
+        success, box = self.tracker.update(frame)
+        if not success:
+            self.active = False
+            return
+        box = scale_box(box, 1 / scale)
+        (x1, y1, w, h) = [int(v) for v in box]
+        annotation = (x1, y1, x1 + w, y1 + h, frame_num)
+        matched_obj_id = finished_index.match(
+            frame_num, annotation[:4], config.TRACKING_IOU_THRESH)
+        if matched_obj_id:
+            self.matched_obj_id = matched_obj_id
+            self.active = False
+            return
+        self.annotations.append(annotation)
+
+    def result(self):
+        if (self.matched_obj_id is None and
+                isinstance(self.tracker, KalmanBoxTracker)):
+            # Without image features there is no evidence the object was
+            # there, backwards boxes only bridge the gap to a matched track
+            return [], None
+        return self.annotations, self.matched_obj_id
 
 # Given a list of annotations(some with or without labels/confidence scores)
 # for multiple objects choose a label for each object
@@ -427,87 +978,114 @@ def length_limit_objects(pred, frame_thresh):
 @profile(stream=fp)
 def generate_video(filename, frames, fps, results,
                    concepts, video_id, annotations):
+    overlays = frame_overlays(results, concepts, annotations)
+    # decoding and drawing run in their own threads, feeding the encoder
+    drawn_frames = draw_frames(
+        stage(frames, 'decoder'), overlays, video_id, len(frames))
+    save_video(filename, stage(drawn_frames, 'renderer'), fps)
 
-    # Combine human and prediction annotations
+
+def generate_overlays(filename, fps, results, concepts, annotations):
+    '''
+    Instead of drawing the boxes into a copy of the video, uploads them as
+    a json track next to where the AI video would be (filename with a
+    .json extension), for drawing over the original video:
+    {"fps", "width", "height", "frames": [{"time", "frame_num", "boxes"}]}
+    with the frames in time order. Each box is [x1, y1, x2, y2, text,
+    is_prediction] in the coordinates of a width x height frame.
+    '''
+    overlays = frame_overlays(results, concepts, annotations)
+    track = {
+        'fps': fps,
+        'width': config.RESIZED_WIDTH,
+        'height': config.RESIZED_HEIGHT,
+        'frames': [
+            {'time': round(frame_num / fps, 3),
+             'frame_num': frame_num,
+             'boxes': [list(box) for box in overlays[frame_num]]}
+            for frame_num in sorted(overlays)]}
+    overlay_file = os.path.splitext(filename)[0] + '.json'
+    with open(overlay_file, 'w') as f:
+        json.dump(track, f, separators=(',', ':'))
+    s3.upload_file(
+        overlay_file, config.S3_BUCKET,
+        config.S3_BUCKET_AIVIDEOS_FOLDER + overlay_file,
+        ExtraArgs={'ContentType': 'application/json'})
+    os.remove(overlay_file)
+
+
+def frame_overlays(results, concepts, annotations):
+    '''
+    Combines the predictions with the human annotations and groups them by
+    frame once, so frames can be drawn as they are streamed.
+    Returns a dictionary of frame_num -> list of (x1, y1, x2, y2, text,
+    is_prediction) boxes.
+    '''
     results = results.append(annotations)
-    # Cast frame_num to int (prevent indexing errors)
-    results.frame_num = results.frame_num.astype('int')
     classmap = get_classmap(concepts)
 
     # make a dictionary mapping conceptid to count (init 0)
     conceptsCounts = {concept: 0 for concept in concepts}
-    total_length = len(results)
-    one_percent_length = int(total_length / 100)
-    f = open('gen.txt', 'w')
-    f.write(str(frames[130]))
-    f.write(str(classmap))
-    seenObjects = []
-    for pred_index, res in enumerate(results.itertuples()):
-        f.write(f'{pred_index}  {res} {type(frames)}')
-
-        if pred_index % one_percent_length == 0:
-            upload_predict_progress(pred_index, video_id, total_length, 3)
-
-        x1, y1, x2, y2 = int(res.x1), int(res.y1), int(res.x2), int(res.y2)
+    seenObjects = set()
+    overlays = {}
+    # Box texts are made in results order so objects keep their numbering
+    for res in results.itertuples():
         # boxText init to concept name
         boxText = classmap[concepts.index(res.label)]
-
-        if pd.isna(res.confidence):  # No confidence means user annotation
-            # Draws a (user) red box
-            # Note: opencv uses color as BGR
-            cv2.rectangle(frames[res.frame_num], (x1, y1),
-                          (x2, y2), (0, 0, 255), 2)
-        else:  # if confidence exists -> AI annotation
+        is_prediction = not pd.isna(res.confidence)
+        if is_prediction:  # AI annotation
             # Keeps count of concepts
             if (res.objectid not in seenObjects):
                 conceptsCounts[res.label] += 1
-                seenObjects.append(res.objectid)
-            # Draw an (AI) green box
-            cv2.rectangle(frames[res.frame_num], (x1, y1),
-                          (x2, y2), (0, 255, 0), 2)
+                seenObjects.add(res.objectid)
             # boxText = count concept-name (confidence) e.g. "1 Starfish (0.5)"
             boxText = str(conceptsCounts[res.label]) + " " + boxText + \
                 " (" + str(round(res.confidence, 3)) + ")"
-        cv2.putText(
-            frames[res.frame_num], boxText,
-            (x1-5, y2+10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        # Cast frame_num to int (prevent indexing errors)
+        overlays.setdefault(int(res.frame_num), []).append(
+            (int(res.x1), int(res.y1), int(res.x2), int(res.y2), boxText,
+             is_prediction))
+    return overlays
 
-    save_video(filename, frames, fps)
+
+def draw_frames(frames, overlays, video_id, total_length):
+    one_percent_length = max(1, int(total_length / 100))
+    for frame_num, frame in enumerate(frames):
+        if frame_num % one_percent_length == 0:
+            upload_predict_progress(frame_num, video_id, total_length, 3)
+        for box in overlays.get(frame_num, ()):
+            draw_annotation(frame, *box)
+        yield frame
+
+
+def draw_annotation(frame, x1, y1, x2, y2, text, is_prediction):
+    if is_prediction:  # AI annotation
+        # Draw an (AI) green box
+        # Note: opencv uses color as BGR
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+    else:  # user annotation
+        # Draws a (user) red box
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
+    cv2.putText(
+        frame, text,
+        (x1-5, y2+10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
 
 
 @profile(stream=fp)
 def save_video(filename, frames, fps):
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(filename, fourcc, fps, frames[0].shape[::-1][1:3])
-    for frame in frames:
-        out.write(frame)
-    out.release()
-
-    # convert to mp4 and upload to s3 and db
-    # requires temp so original not overwritten
-    converted_file = 'temp.mp4'
-    # Convert file so we can stream on s3
-    ff = FFmpeg(
-        inputs={filename: ['-loglevel', '0']},
-        outputs={converted_file: ['-codec:v', 'libx264', '-y']}
-    )
-    print(ff.cmd)
+    # Encoded straight to streamable H.264 as the frames are drawn
+    if not encode_video(filename, frames, fps):
+        print("no frames to save")
+        return
     print(psutil.virtual_memory())
-    ff.run()
 
-    # temp = ['ffmpeg', '-loglevel', '0', '-i', filename,
-    #         '-codec:v', 'libx264', '-y', converted_file]
-    # subprocess.call(temp)
     # upload video..
     s3.upload_file(
-        converted_file, config.S3_BUCKET,
+        filename, config.S3_BUCKET,
         config.S3_BUCKET_AIVIDEOS_FOLDER + filename,
         ExtraArgs={'ContentType': 'video/mp4'})
-    # remove files once uploaded
-    os.system('rm \'' + filename + '\'')
-    os.system('rm ' + converted_file)
-
-    cv2.destroyAllWindows()
+    # remove file once uploaded
+    os.remove(filename)
 
 # Chooses single prediction for each object (the middle frame)
 
@@ -526,8 +1104,7 @@ def get_final_predictions(results):
     return middle_frames
 
 
-def handle_annotation(prediction, frames, videoid, videoheight, videowidth, userid, fps, collection_id):
-    frame = frames[int(prediction.frame_num)]
+def handle_annotation(prediction, frame, videoid, videoheight, videowidth, userid, fps, collection_id):
     annotation_id = upload_annotation(frame,
                                       *prediction.loc[['x1', 'x2', 'y1',
                                                        'y2', 'frame_num',
@@ -586,6 +1163,8 @@ def upload_predict_progress(count, videoid, total_count, status):
     total_count - total number of frames in the video (or number of predictions + annotations)
     status - Indicates whether processing video or drawing annotation boxes
     '''
+    if not report_progress:
+        return
     print(
         f'count: {count} total_count: {total_count} vid: {videoid} status: {status}')
     if (count == 0):
@@ -0,0 +1,133 @@
+"""
+INT8 quantization of the ONNX model (see onnx_backend), for predicting on
+machines without a GPU.
+
+The model is calibrated on frames from the AnnotationGenerator validation
+split, fed to it the same way predict_frames feeds video frames: not
+preprocessed, and resized to the detector_size of the frame. The
+quantized model is timed and compared with the float model on the same
+inputs: the speedup and the change in each concept's F1 (from
+f1_evaluation) are reported, so whether to predict with it can be decided
+per model.
+"""
+import time
+
+import cv2
+import numpy as np
+import pandas as pd
+from onnxruntime.quantization import (
+    CalibrationDataReader, QuantType, quantize_static)
+
+from config import config
+from predict import predict
+from predict.onnx_backend import OnnxRetinaNet
+from train.evaluation.model_scoring import f1_evaluation
+from utils.model_files import onnx_path, quantized_path
+
+
+class PredictionInputs(object):
+    """ Wraps an AnnotationGenerator so the images are the model inputs of
+        predicting on video (see run_model) instead of the training inputs:
+        not preprocessed, and resized to detector_size with INTER_AREA.
+        keras_retinanet's evaluation (f1_evaluation) reads the images
+        through preprocess_image and resize_image, which are replaced.
+    """
+
+    def __init__(self, generator):
+        self.generator = generator
+
+    def __getattr__(self, name):
+        return getattr(self.generator, name)
+
+    def preprocess_image(self, image):
+        return image
+
+    def resize_image(self, image):
+        """ Returns the resized image and its scale, like the generator """
+        height, width = image.shape[:2]
+        size = predict.detector_size(width, height)
+        if tuple(size) == (width, height):
+            return image, 1
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        return image, size[0] / width
+
+    def model_input(self, index):
+        return self.resize_image(self.load_image(index))[0]
+
+
+class CalibrationFrames(CalibrationDataReader):
+    """ Feeds num_frames model inputs, spread over the generator, one at a
+        time
+    """
+
+    def __init__(self, inputs, input_name, num_frames):
+        self.inputs = inputs
+        self.input_name = input_name
+        self.indices = iter(sample_indices(inputs, num_frames))
+
+    def get_next(self):
+        index = next(self.indices, None)
+        if index is None:
+            return None
+        frame = self.inputs.model_input(index)
+        return {self.input_name: frame[np.newaxis].astype(np.float32)}
+
+
+def sample_indices(generator, num_frames):
+    return np.unique(np.linspace(
+        0, generator.size() - 1, min(num_frames, generator.size()),
+        dtype=int))
+
+
+def quantize_model(weights_path, generator, num_frames=None):
+    """ Writes the INT8 model for weights_path, calibrated on generator """
+    num_frames = num_frames or config.CALIBRATION_FRAMES
+    # Exports the float model if it hasn't been yet
+    float_model = predict.init_model(weights_path, 'onnx')
+    start = time.perf_counter()
+    quantize_static(
+        onnx_path(weights_path), quantized_path(weights_path),
+        CalibrationFrames(PredictionInputs(generator),
+                          float_model.input_name, num_frames),
+        per_channel=True, weight_type=QuantType.QInt8)
+    print(f'Quantized {onnx_path(weights_path)} on {num_frames} frames in '
+          f'{time.perf_counter() - start:.2f}s')
+
+
+def compare_quantized(weights_path, generator, num_frames=None):
+    """ Times the float and INT8 models on frames of the generator and
+        evaluates both with f1_evaluation, on the inputs they were
+        calibrated on. Returns the F1 of each concept with both models.
+    """
+    num_frames = num_frames or config.CALIBRATION_FRAMES
+    inputs = PredictionInputs(generator)
+    frames = [inputs.model_input(index)
+              for index in sample_indices(inputs, num_frames)]
+    models = {
+        'float': OnnxRetinaNet(onnx_path(weights_path), config.ONNX_THREADS),
+        'int8': OnnxRetinaNet(
+            quantized_path(weights_path), config.ONNX_THREADS)}
+
+    run_times = {}
+    f1_scores = {}
+    for name, model in models.items():
+        predict.warm_up(model)
+        start = time.perf_counter()
+        for index in range(0, len(frames), config.DETECTION_BATCH_SIZE):
+            model.predict_on_batch(
+                np.stack(frames[index:index + config.DETECTION_BATCH_SIZE]))
+        run_times[name] = time.perf_counter() - start
+        best_f1, _ = f1_evaluation(inputs, model)
+        f1_scores[name] = {
+            generator.label_to_name(label): f1
+            for label, f1 in best_f1.items()}
+
+    metrics = pd.DataFrame(f1_scores)
+    metrics.index.name = 'conceptid'
+    metrics['f1_change'] = metrics['int8'] - metrics['float']
+    metrics['speedup'] = run_times['float'] / run_times['int8']
+    print(f"INT8 model: {len(frames) / run_times['int8']:.2f} frames/sec, "
+          f"float model: {len(frames) / run_times['float']:.2f} frames/sec, "
+          f"speedup {run_times['float'] / run_times['int8']:.2f}x")
+    print(metrics)
+    return metrics
@@ -0,0 +1,158 @@
+"""
+Replays tracking and scoring from cached detections (see detection_cache)
+over a grid of parameters, without running the model. Run from the ml
+folder. First fetch a video, its annotations and its detections:
+
+    python -m predict.replay fetch 86 weights.h5 1629 1210 236 --out replay
+
+then sweep parameters over them in parallel:
+
+    python -m predict.replay sweep replay/86.mp4 replay/86_annotations.csv \\
+        replay/86_<model key>.npz 1629 1210 236 \\
+        --thresholds 0.3 0.5 0.7 --iou 0.1 0.2 0.3 --min-frames 5 15 30
+
+which writes the score_predictions metrics (and counts) of every concept
+at every point of the grid to a csv. --num-frames only makes sense for
+detections cached without adaptive keyframes, the keyframes that are a
+multiple of each value are replayed.
+"""
+import argparse
+import itertools
+import multiprocessing
+import os
+import shutil
+
+import pandas as pd
+
+from config import config
+from predict import predict
+from predict.detection_cache import DetectionCache
+from predict.evaluate_prediction_vid import score_predictions, get_counts
+from predict.frames import VideoFrames
+from utils.query import s3, pd_query
+
+PARAMETERS = ['threshold', 'num_frames', 'tracking_iou', 'min_frames']
+
+
+def fetch(videoid, weights, concepts, out):
+    """ Downloads a video and saves its annotations and cached detections
+        (for the model with the given weights) in out
+    """
+    os.makedirs(out, exist_ok=True)
+    vid_filename = pd_query(
+        "SELECT filename FROM videos WHERE id=%s",
+        (int(videoid),)).iloc[0].filename
+    video_path = os.path.join(out, f'{videoid}.mp4')
+    s3.download_file(config.S3_BUCKET, config.S3_VIDEO_FOLDER + vid_filename,
+                     video_path)
+    frames = VideoFrames(vid_filename, video_path)
+    predict.get_annotations(videoid, concepts, frames.fps).to_csv(
+        os.path.join(out, f'{videoid}_annotations.csv'), index=False)
+    cache = DetectionCache.for_video(
+        videoid, predict.detection_model_key(weights, frames))
+    if not cache:
+        print(f'No cached detections for video {videoid} with {weights}, '
+              'predict on it first')
+        return
+    shutil.copy(cache.path, os.path.join(out, cache.filename))
+    print(f'Saved video {videoid} to {out}')
+
+
+def sweep(video_path, annotations_path, cache_path, concepts, grid, workers):
+    """ Replays every point (dictionary of PARAMETERS) of grid on workers
+        processes. Returns the metrics of every concept at every point.
+    """
+    jobs = [(video_path, annotations_path, cache_path, concepts, point)
+            for point in grid]
+    print(f'Replaying {len(jobs)} parameter sets on {workers} workers')
+    # Same as predicting, workers start fresh instead of forking
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers) as pool:
+        metrics = pool.map(_replay, jobs)
+    return pd.concat(metrics)
+
+
+def replay(video_path, annotations_path, cache_path, concepts, point):
+    """ Tracks, propagates and scores the cached detections with the
+        parameters of point, as predict_on_video and evaluate would
+    """
+    config.THRESHOLDS = [point['threshold']] * len(config.THRESHOLDS)
+    config.TRACKING_IOU_THRESH = point['tracking_iou']
+    config.MIN_FRAMES_THRESH = point['min_frames']
+    cache = DetectionCache.from_file(cache_path)
+    if point['num_frames']:
+        cache = cache.every(point['num_frames'])
+    if not cache:
+        raise ValueError(f'no cached detections to replay with {point}')
+    frames = VideoFrames(os.path.basename(video_path), video_path)
+    annotations = pd.read_csv(annotations_path)
+
+    results = predict.predict_frames(frames, frames.fps, None, None, cache)
+    if results.empty:
+        metrics = score_predictions(
+            annotations, results, config.EVALUATION_IOU_THRESH, concepts)
+    else:
+        results = predict.propagate_conceptids(results, concepts)
+        results = predict.length_limit_objects(
+            results, config.MIN_FRAMES_THRESH)
+        metrics = score_predictions(
+            annotations, results, config.EVALUATION_IOU_THRESH, concepts)
+        metrics = metrics.set_index('conceptid').join(
+            get_counts(results, annotations)).reset_index()
+    for parameter in PARAMETERS:
+        metrics[parameter] = point[parameter]
+    return metrics
+
+
+def _replay(job):
+    return replay(*job)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    fetch_parser = commands.add_parser(
+        'fetch', help='save a video with its annotations and detections')
+    fetch_parser.add_argument('videoid', type=int)
+    fetch_parser.add_argument('weights')
+    fetch_parser.add_argument('concepts', type=int, nargs='+')
+    fetch_parser.add_argument('--out', default='replay')
+
+    sweep_parser = commands.add_parser(
+        'sweep', help='replay a grid of parameters')
+    sweep_parser.add_argument('video')
+    sweep_parser.add_argument('annotations')
+    sweep_parser.add_argument('detections')
+    sweep_parser.add_argument('concepts', type=int, nargs='+')
+    sweep_parser.add_argument('--thresholds', type=float, nargs='+',
+                              default=[config.THRESHOLDS[0]])
+    sweep_parser.add_argument('--num-frames', type=int, nargs='+',
+                              default=[0], help='0 replays every keyframe')
+    sweep_parser.add_argument('--iou', type=float, nargs='+',
+                              default=[config.TRACKING_IOU_THRESH])
+    sweep_parser.add_argument('--min-frames', type=int, nargs='+',
+                              default=[config.MIN_FRAMES_THRESH])
+    # every worker also tracks on TRACKING_THREADS threads
+    sweep_parser.add_argument(
+        '--workers', type=int,
+        default=max(1, multiprocessing.cpu_count() //
+                    max(config.TRACKING_THREADS, 1)))
+    sweep_parser.add_argument('--out', default='sweep.csv')
+
+    args = parser.parse_args()
+    if args.command == 'fetch':
+        fetch(args.videoid, args.weights, args.concepts, args.out)
+    elif args.command == 'sweep':
+        grid = [dict(zip(PARAMETERS, values)) for values in itertools.product(
+            args.thresholds, args.num_frames, args.iou, args.min_frames)]
+        metrics = sweep(args.video, args.annotations, args.detections,
+                        args.concepts, grid, args.workers)
+        metrics.to_csv(args.out, index=False)
+        print(metrics)
+
+
+if __name__ == '__main__':
+    main()
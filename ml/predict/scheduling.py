@@ -0,0 +1,108 @@
+import cv2
+import numpy as np
+
+from config import config
+
+# Size of the thumbnails compared to measure motion between frames
+THUMBNAIL_SIZE = (64, 36)
+# Side (in thumbnail pixels) of the cells compared by cell_difference
+CELL_SIZE = 4
+
+
+def make_thumbnail(frame):
+    """ Small grayscale copy of a frame, cheap to compare with others """
+    thumbnail = cv2.resize(frame, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+    if thumbnail.ndim == 3:
+        thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY)
+    return thumbnail.astype(np.int16)
+
+
+def frame_difference(thumbnail_a, thumbnail_b):
+    """ Mean absolute difference of two thumbnails (0-255) """
+    return np.mean(np.abs(thumbnail_a - thumbnail_b))
+
+
+def cell_difference(thumbnail_a, thumbnail_b):
+    """ Largest mean absolute difference (0-255) of any CELL_SIZE square
+        cell of two thumbnails, so a small object moving isn't averaged
+        away over the whole frame
+    """
+    difference = np.abs(thumbnail_a - thumbnail_b)
+    rows = difference.shape[0] // CELL_SIZE
+    cols = difference.shape[1] // CELL_SIZE
+    cells = difference[:rows * CELL_SIZE, :cols * CELL_SIZE].reshape(
+        rows, CELL_SIZE, cols, CELL_SIZE)
+    return cells.mean(axis=(1, 3)).max()
+
+
+class FixedKeyframes(object):
+    """ Makes keyframes of the given frame numbers only, used to replay the
+        keyframes of a DetectionCache
+    """
+
+    def __init__(self, frame_nums):
+        self.frame_nums = set(frame_nums)
+
+    def is_keyframe(self, frame_num, frame):
+        return frame_num in self.frame_nums
+
+
+class KeyframeScheduler(object):
+    """ Decides which frames the model is run on.
+
+        With adaptive keyframes, the interval between keyframes shrinks
+        from max_interval towards min_interval as the motion between
+        frames (the difference of their thumbnails) goes from the low to
+        the high motion threshold (the largest motion seen since the last
+        keyframe counts). Otherwise every NUM_FRAMES-th frame is a
+        keyframe.
+
+        Keyframes only depend on the decoded frames, never on tracking
+        results: the detector stage picks them ahead of tracking, so
+        feedback from it would make the schedule (and the predictions)
+        depend on the batch size and thread timing.
+    """
+
+    def __init__(self, adaptive=None, min_interval=None, max_interval=None,
+                 motion_thresholds=None):
+        self.adaptive = (config.ADAPTIVE_KEYFRAMES
+                         if adaptive is None else adaptive)
+        self.min_interval = min_interval or config.MIN_FRAMES_BETWEEN_PREDICTIONS
+        self.max_interval = max_interval or config.MAX_FRAMES_BETWEEN_PREDICTIONS
+        self.low_motion, self.high_motion = (
+            motion_thresholds or config.KEYFRAME_MOTION_THRESHOLDS)
+        self.last_keyframe = None
+        self.last_thumbnail = None
+        self.motion = 0
+
+    def is_keyframe(self, frame_num, frame):
+        if not self.adaptive:
+            return frame_num % config.NUM_FRAMES == 0
+
+        thumbnail = make_thumbnail(frame)
+        if self.last_thumbnail is not None:
+            self.motion = max(
+                self.motion, frame_difference(thumbnail, self.last_thumbnail))
+        self.last_thumbnail = thumbnail
+
+        if self.last_keyframe is None:
+            return self._keyframe(frame_num)
+        frames_since = frame_num - self.last_keyframe
+        if frames_since < self.min_interval:
+            return False
+        if frames_since >= self.interval():
+            return self._keyframe(frame_num)
+        return False
+
+    def interval(self):
+        """ Current target interval between keyframes, given the motion """
+        amount = ((self.motion - self.low_motion) /
+                  max(self.high_motion - self.low_motion, 1e-6))
+        amount = min(max(amount, 0), 1)
+        return round(self.max_interval -
+                     amount * (self.max_interval - self.min_interval))
+
+    def _keyframe(self, frame_num):
+        self.last_keyframe = frame_num
+        self.motion = 0
+        return True
@@ -0,0 +1,74 @@
+import math
+
+import pandas as pd
+
+from config import config
+from predict import matching
+
+
+def segment_bounds(total_frames, fps, segment_seconds, overlap_seconds):
+    """ Splits a video into segments of segment_seconds. Each segment also
+        covers overlap_seconds before its own frames, so tracks crossing the
+        boundary can be stitched to the previous segment's.
+        Returns (start, first_owned, stop) frame numbers for every segment,
+        the last segment's stop is None (read to the end of the video).
+    """
+    length = max(1, round(fps * segment_seconds))
+    overlap = math.ceil(fps * overlap_seconds)
+    bounds = []
+    for first_owned in range(0, max(total_frames, 1), length):
+        stop = first_owned + length
+        bounds.append((max(0, first_owned - overlap), first_owned,
+                       stop if stop < total_frames else None))
+    return bounds
+
+
+def stitch_segments(segment_results, bounds):
+    """ Joins the results of consecutive segments. A track of a segment that
+        overlaps a track of the previous segment (during the frames both
+        segments covered) continues it: it takes the previous track's
+        objectid and its duplicate rows from the overlap are dropped.
+    """
+    stitched = [segment_results[0]]
+    for results, (_, first_owned, _) in zip(
+            segment_results[1:], bounds[1:]):
+        previous = stitched[-1]
+        in_overlap = results.frame_num < first_owned
+        objectids = match_tracks(previous, results[in_overlap])
+        continued = results.objectid.isin(list(objectids))
+        results = results[~(continued & in_overlap)].copy()
+        results['objectid'] = [
+            objectids.get(objectid, objectid)
+            for objectid in results.objectid]
+        stitched.append(results)
+    return pd.concat(stitched, ignore_index=True)
+
+
+def match_tracks(previous, overlap):
+    """ Matches the tracks in overlap to the tracks of previous with boxes
+        on the same frames. Tracks sharing more frames (with a mean IOU of
+        at least TRACKING_IOU_THRESH) are matched first, one to one.
+        Returns a dictionary from overlap objectids to previous objectids.
+    """
+    columns = ['x1', 'y1', 'x2', 'y2', 'objectid', 'frame_num']
+    pairs = previous[columns].merge(
+        overlap[columns], on='frame_num', suffixes=('_previous', ''))
+    if pairs.empty:
+        return {}
+    pairs['iou'] = matching.paired_iou(
+        pairs[['x1_previous', 'y1_previous', 'x2_previous', 'y2_previous']]
+        .values.astype(float),
+        pairs[['x1', 'y1', 'x2', 'y2']].values.astype(float))
+    tracks = pairs.groupby(['objectid_previous', 'objectid']).iou.agg(
+        ['mean', 'count']).reset_index()
+    tracks = tracks[tracks['mean'] >= config.TRACKING_IOU_THRESH]
+    tracks = tracks.sort_values(['count', 'mean'], ascending=False)
+    objectids = {}
+    matched_previous = set()
+    for track in tracks.itertuples():
+        if (track.objectid in objectids or
+                track.objectid_previous in matched_previous):
+            continue
+        objectids[track.objectid] = track.objectid_previous
+        matched_previous.add(track.objectid_previous)
+    return objectids
@@ -0,0 +1,126 @@
+import math
+import multiprocessing
+import time
+
+import psutil
+
+from config import config
+from predict import predict
+from predict.evaluate_prediction_vid import evaluate
+from predict.frames import VideoFrames
+from utils.query import pd_query
+
+GIGABYTE = 1024 ** 3
+# Decoded source frames held by the video decoder
+DECODER_FRAMES = 16
+# Results and biologist annotations kept per frame of video
+RESULT_BYTES_PER_FRAME = 4096
+
+# Model of an evaluation worker process, loaded once by _init_worker
+worker_model = None
+
+
+def estimate_memory(fps, width, height, length):
+    """ Rough estimate of the memory (in bytes) needed to predict on a
+        video, not counting the model. Covers the frames buffered by the
+        prediction pipeline and the results, which grow with the video.
+    """
+    frame_bytes = config.RESIZED_WIDTH * config.RESIZED_HEIGHT * 3
+    tracking_frame_bytes = frame_bytes
+    if config.TRACKING_FRAME_SCALE != 1:
+        # grayscale and downscaled
+        tracking_frame_bytes = (
+            frame_bytes * config.TRACKING_FRAME_SCALE ** 2 / 3)
+    keyframe_interval = (config.MAX_FRAMES_BETWEEN_PREDICTIONS
+                         if config.ADAPTIVE_KEYFRAMES else config.NUM_FRAMES)
+    pipeline_frames = (2 * config.PIPELINE_QUEUE_SIZE +
+                       (config.DETECTION_BATCH_SIZE - 1) * keyframe_interval +
+                       1)
+    history_frames = math.ceil(fps * config.MAX_TIME_BACK) + 1
+    return (DECODER_FRAMES * width * height * 3 +
+            pipeline_frames * frame_bytes +
+            history_frames * tracking_frame_bytes +
+            length * RESULT_BYTES_PER_FRAME)
+
+
+def video_memory(video_id):
+    """ Estimated memory needed to predict on a video in the database """
+    vid_filename = pd_query(
+        "SELECT filename FROM videos WHERE id=%s",
+        (int(video_id),)).iloc[0].filename
+    frames = VideoFrames(vid_filename)
+    return estimate_memory(frames.fps, frames.width, frames.height,
+                           len(frames))
+
+
+def memory_budget():
+    """ Memory (in bytes) the evaluation jobs may use, excluding models """
+    if config.EVALUATION_MEMORY_BUDGET_GB:
+        budget = config.EVALUATION_MEMORY_BUDGET_GB * GIGABYTE
+    else:
+        # leave some room for everything else on the instance
+        budget = 0.8 * psutil.virtual_memory().available
+    return budget - config.EVALUATION_WORKERS * config.MODEL_MEMORY_GB * GIGABYTE
+
+
+def evaluate_within_budget(jobs, on_finish=None):
+    """ Runs evaluate(*job) for every job on EVALUATION_WORKERS processes,
+        each with its own loaded model. A job is only started while the
+        estimated memory of the running jobs plus its own fits the memory
+        budget (a job is always started when nothing else is running).
+        The workers don't report progress, on_finish(job, finished) is
+        called in this process as each job finishes instead.
+    """
+    estimates = [video_memory(job[0]) for job in jobs]
+    budget = memory_budget()
+    print(f'Evaluating {len(jobs)} videos with a memory budget of '
+          f'{budget / GIGABYTE:.1f} GB')
+    waiting = list(zip(jobs, estimates))
+    # exported once here rather than by every worker
+    predict.prepare_model(config.WEIGHTS_PATH)
+    running = []
+    used = 0
+    finished = 0
+    # Keras can't be used after a fork, so workers start fresh
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(config.EVALUATION_WORKERS, initializer=_init_worker,
+                      initargs=(config.WEIGHTS_PATH,)) as pool:
+        while waiting or running:
+            index = 0
+            while (index < len(waiting) and
+                   len(running) < config.EVALUATION_WORKERS):
+                job, estimate = waiting[index]
+                if running and used + estimate > budget:
+                    index += 1
+                    continue
+                del waiting[index]
+                print(f'Starting video {job[0]} '
+                      f'(estimated {estimate / GIGABYTE:.2f} GB)')
+                running.append(
+                    (job, pool.apply_async(_evaluate, job), estimate))
+                used += estimate
+
+            time.sleep(1)
+            still_running = []
+            for job, result, estimate in running:
+                if result.ready():
+                    # re-raises the exception if the job failed
+                    result.get()
+                    used -= estimate
+                    finished += 1
+                    if on_finish is not None:
+                        on_finish(job, finished)
+                else:
+                    still_running.append((job, result, estimate))
+            running = still_running
+
+
+def _init_worker(model_path):
+    global worker_model
+    # only the parent process reports progress, see evaluate_within_budget
+    predict.report_progress = False
+    worker_model = predict.init_model(model_path)
+
+
+def _evaluate(*job):
+    evaluate(*job, model=worker_model)
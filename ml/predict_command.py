@@ -1,3 +1,5 @@
+import os
+
 from psycopg2 import connect
 import subprocess
 from dotenv import load_dotenv
@@ -6,6 +8,8 @@ import json
 from utils.query import s3, con, cursor, pd_query
 from config.config import S3_BUCKET, S3_WEIGHTS_FOLDER, WEIGHTS_PATH,\
     AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, S3_STDOUT_FOLDER
+from utils.model_files import inference_path, quantized_path,\
+    INFERENCE_SUFFIX, QUANTIZED_SUFFIX
 from train_command import setup_predict_progress, evaluate_videos, end_predictions, shutdown_server
 from botocore.exceptions import ClientError
 
@@ -54,6 +58,42 @@ def download_weights(user_model):
     except ClientError as e:
         print("Could not find weights file {0} in S3".format(filename))
         raise e
+    download_inference_model(user_model)
+    download_quantized_model(user_model)
+
+
+def download_inference_model(user_model):
+    """ Models trained before inference models were uploaded don't have
+        one, they are converted from the weights when loaded instead
+    """
+    filename = user_model + INFERENCE_SUFFIX
+    try:
+        s3.download_file(
+            S3_BUCKET,
+            S3_WEIGHTS_FOLDER + filename,
+            inference_path(WEIGHTS_PATH)
+        )
+        print("downloaded file: {0}".format(filename))
+    except ClientError:
+        print("No inference model {0} in S3, converting weights".format(
+            filename))
+        if os.path.exists(inference_path(WEIGHTS_PATH)):
+            os.remove(inference_path(WEIGHTS_PATH))
+
+
+def download_quantized_model(user_model):
+    """ Only models trained with quantize_model set have an INT8 model """
+    filename = user_model + QUANTIZED_SUFFIX
+    try:
+        s3.download_file(
+            S3_BUCKET,
+            S3_WEIGHTS_FOLDER + filename,
+            quantized_path(WEIGHTS_PATH)
+        )
+        print("downloaded file: {0}".format(filename))
+    except ClientError:
+        if os.path.exists(quantized_path(WEIGHTS_PATH)):
+            os.remove(quantized_path(WEIGHTS_PATH))
 
 
 def reset_predict_params():
@@ -18,7 +18,10 @@ from skimage.measure import compare_ssim
 
 from config.config import RESIZED_WIDTH, RESIZED_HEIGHT, S3_BUCKET, \
     S3_ANNOTATION_FOLDER, S3_VIDEO_FOLDER, DB_NAME, DB_USER, DB_PASSWORD, \
-    DB_HOST, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, LENGTH
+    DB_HOST, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, LENGTH, \
+    TRACKING_FRAME_SCALE
+from utils.tracking_frames import make_tracking_frame, scale_box
+from utils.video_encoder import VideoEncoder
 s3 = boto3.client(
     's3',
     aws_access_key_id=AWS_ACCESS_KEY_ID,
@@ -142,31 +145,25 @@ def upload_video(priorFrames, postFrames, id):
     priorFrames.extend(postFrames)
 
     output_file = str(uuid.uuid4()) + ".mp4"
-    converted_file = str(uuid.uuid4()) + ".mp4"
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_file, fourcc, 20,
-                          (RESIZED_WIDTH, RESIZED_HEIGHT))
-    for frame in priorFrames:
-        out.write(frame)
-    out.release()
-    # Convert file so we can stream on s3
-    temp = ['ffmpeg', '-loglevel', '0', '-i', output_file,
-            '-codec:v', 'libx264', '-y', converted_file]
-    subprocess.call(temp)
-
-    if os.path.isfile(converted_file):
+    # Encoded straight to streamable H.264
+    try:
+        with VideoEncoder(output_file, 20,
+                          RESIZED_WIDTH, RESIZED_HEIGHT) as encoder:
+            for frame in priorFrames:
+                encoder.write(frame)
+    except subprocess.CalledProcessError:
+        print("Failed to make video for annotations: " + str(id))
+    else:
         # upload video..
         s3.upload_file(
-            converted_file,
+            output_file,
             S3_BUCKET,
             S3_VIDEO_FOLDER + str(id) + "_tracking.mp4",
             ExtraArgs={'ContentType': 'video/mp4'}
         )
-        os.system('rm ' + converted_file)
         completed = True
-    else:
-        print("Failed to make video for annotations: " + str(id))
-    os.system('rm ' + output_file)
+    if os.path.isfile(output_file):
+        os.system('rm ' + output_file)
     return completed
 
 
@@ -237,6 +234,8 @@ def track_object(frame_num, frames, box, track_forward, end,
     # keep tracking object until its out of frame or time is up
     for index, frame in enumerate(frames):
         (x1, y1, w, h) = [int(v) for v in box]
+        x2 = x1 + w
+        y2 = y1 + h
         # Remove invalid bounding boxes
         if (
                 x1 >= RESIZED_WIDTH or
@@ -249,11 +248,15 @@ def track_object(frame_num, frames, box, track_forward, end,
         time_elapsed += (1 / fps) if track_forward else - (1 / fps)
         frame_num += 1 if track_forward else -1
         frame_no_box = copy.deepcopy(frame)
+        # trackers run on a (possibly downscaled) tracking frame
+        tracking_frame = make_tracking_frame(frame, TRACKING_FRAME_SCALE)
         if index == 0:  # initialize bounding box in first frame
-            trackers.add(tracker, frame, box)
-        (success, boxes) = trackers.update(frame)
+            trackers.add(tracker, tracking_frame,
+                         scale_box(box, TRACKING_FRAME_SCALE))
+        (success, boxes) = trackers.update(tracking_frame)
         if success:
             for box in boxes:
+                box = scale_box(box, 1 / TRACKING_FRAME_SCALE)
                 (x1, y1, w, h) = [int(v) for v in box]
                 x2 = x1 + w
                 y2 = y1 + h
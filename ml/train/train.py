@@ -8,6 +8,7 @@ import tensorflow as tf
 import multiprocessing
 from tensorflow.python.client import device_lib
 from keras_retinanet import models
+from keras_retinanet.models import convert_model
 from keras_retinanet import losses
 from keras.utils import multi_gpu_model
 from keras.callbacks import EarlyStopping
@@ -15,6 +16,8 @@ from keras_retinanet.callbacks import RedirectModel
 
 from config import config
 from utils.query import s3, query
+from utils.model_files import inference_path, quantized_path,\
+    INFERENCE_SUFFIX, QUANTIZED_SUFFIX
 from utils.timer import timer
 from utils.output import DatabaseOutput
 from train.preprocessing.annotation_generator import AnnotationGenerator
@@ -118,13 +121,18 @@ def train_model(concepts,
     )
 
     model.save(config.WEIGHTS_PATH)
+    # Predicting can load this directly instead of converting the weights
+    convert_model(model).save(inference_path(config.WEIGHTS_PATH))
 
-    # Upload the weights file to the S3 bucket
+    # Upload the weights and inference model files to the S3 bucket
     _upload_weights(model_name)
 
     # Evaluate the best confidence thresholds for the model
     evaluate_class_thresholds(model, test_generator)
 
+    if config.QUANTIZE_MODEL:
+        _quantize(model_name, test_generator)
+
 
 def _initilize_model(num_classes):
     """Initilze our model to train with
@@ -185,13 +193,40 @@ def _get_callbacks(model,
 
 
 def _upload_weights(model_name):
-    """ Upload model weights to s3 bucket
+    """ Upload model weights and the inference model to s3 bucket
     """
     s3.upload_file(
         config.WEIGHTS_PATH,
         config.S3_BUCKET,
         config.S3_WEIGHTS_FOLDER + model_name + ".h5"
     )
+    s3.upload_file(
+        inference_path(config.WEIGHTS_PATH),
+        config.S3_BUCKET,
+        config.S3_WEIGHTS_FOLDER + model_name + INFERENCE_SUFFIX
+    )
+
+
+def _quantize(model_name, test_generator):
+    """ Makes an INT8 model calibrated on the validation frames, compares it
+        with the float model and uploads both the model and the comparison
+    """
+    # onnxruntime and tf2onnx are only needed when quantizing
+    from predict import quantize
+    quantize.quantize_model(config.WEIGHTS_PATH, test_generator)
+    metrics = quantize.compare_quantized(config.WEIGHTS_PATH, test_generator)
+    metrics.to_csv('quantization.csv')
+    s3.upload_file(
+        quantized_path(config.WEIGHTS_PATH),
+        config.S3_BUCKET,
+        config.S3_WEIGHTS_FOLDER + model_name + QUANTIZED_SUFFIX
+    )
+    s3.upload_file(
+        'quantization.csv',
+        config.S3_BUCKET,
+        config.S3_METRICS_FOLDER + model_name + '_int8.csv',
+        ExtraArgs={"ContentType": "application/vnd.ms-excel"},
+    )
 
 
 def _redirect_outputs(job_id):
@@ -6,6 +6,7 @@ from botocore.exceptions import ClientError
 
 import upload_stdout
 from predict.evaluate_prediction_vid import evaluate
+from predict.video_jobs import evaluate_within_budget
 from train.train import train_model
 from config import config
 from utils.query import s3, con, cursor, pd_query
@@ -227,16 +228,42 @@ def evaluate_videos(concepts, verify_videos, user_model,
     """ Run evaluate on all the evaluation videos
     """
 
-    # We go one by one as multiprocessing ran into memory issues
-    for video_id in verify_videos:
-        cursor.execute(
-            f"""UPDATE predict_progress SET videoid = {video_id}, current_video = current_video + 1"""
-        )
-        con.commit()
-        evaluate(video_id, user_model, concepts, upload_annotations, userid, create_collection)
+    if config.EVALUATION_WORKERS > 1:
+        # As many videos at once as fit in memory
+        jobs = [(video_id, user_model, concepts, upload_annotations, userid,
+                 create_collection) for video_id in verify_videos]
+        evaluate_within_budget(
+            jobs, on_finish=lambda job, finished: finish_video_progress(
+                job[0], finished, len(jobs)))
+    else:
+        for video_id in verify_videos:
+            start_video_progress(video_id)
+            evaluate(video_id, user_model, concepts, upload_annotations, userid, create_collection)
 
     end_predictions()
 
+
+def start_video_progress(video_id):
+    cursor.execute(
+        f"""UPDATE predict_progress SET videoid = {video_id}, current_video = current_video + 1"""
+    )
+    con.commit()
+
+
+def finish_video_progress(video_id, finished, total):
+    """ Progress of videos evaluated concurrently, counted in videos: the
+        frame progress shows how many of the videos have finished
+    """
+    cursor.execute(
+        """
+        UPDATE predict_progress
+        SET videoid=%s, current_video=%s, framenum=%s, totalframe=%s,
+            status=2""",
+        (video_id, finished, finished, total),
+    )
+    con.commit()
+
+
 def reset_model_params():
     """ Reset the model_params table
     """
@@ -0,0 +1,38 @@
+import os
+
+# Suffix of converted inference models (regression and NMS layers already
+# attached), saved and uploaded next to the training weights
+INFERENCE_SUFFIX = '_inference.h5'
+# Suffix of INT8 quantized ONNX models, made and uploaded after training
+# when quantize_model is set
+QUANTIZED_SUFFIX = '_int8.onnx'
+
+
+def inference_path(weights_path):
+    """ Where the inference model for weights_path is kept, e.g.
+        weights.h5 -> weights_inference.h5
+    """
+    return os.path.splitext(weights_path)[0] + INFERENCE_SUFFIX
+
+
+def onnx_path(weights_path):
+    """ Where the ONNX export of weights_path is kept """
+    return os.path.splitext(weights_path)[0] + '.onnx'
+
+
+def quantized_path(weights_path):
+    """ Where the INT8 quantized ONNX model of weights_path is kept """
+    return os.path.splitext(weights_path)[0] + QUANTIZED_SUFFIX
+
+
+def has_inference_model(weights_path):
+    """ Whether weights_path has an inference model that was saved or
+        downloaded after the weights themselves (otherwise it's stale)
+    """
+    return is_newer(inference_path(weights_path), weights_path)
+
+
+def is_newer(path, weights_path):
+    """ Whether the file at path exists and was written after weights_path """
+    return (os.path.exists(path) and
+            os.path.getmtime(path) >= os.path.getmtime(weights_path))
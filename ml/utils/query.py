@@ -5,13 +5,31 @@ import boto3
 from config import config
 
 
-con = connect(
+class _Deferred(object):
+    """
+    Stands in for the object make() returns, which is only made when it is
+    first used
+    """
+
+    def __init__(self, make):
+        self._make = make
+        self._object = None
+
+    def __getattr__(self, name):
+        if self._object is None:
+            self._object = self._make()
+        return getattr(self._object, name)
+
+
+# Only connects on the first query, so modules can be imported (e.g. for
+# s3, or by worker processes) without database access
+con = _Deferred(lambda: connect(
     database=config.DB_NAME,
     user=config.DB_USER,
     password=config.DB_PASSWORD,
     host=config.DB_HOST
-)
-cursor = con.cursor()
+))
+cursor = _Deferred(lambda: con.cursor())
 
 s3 = boto3.client(
     's3',
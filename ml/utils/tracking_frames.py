@@ -0,0 +1,18 @@
+import cv2
+
+
+def make_tracking_frame(frame, scale):
+    """
+    Returns the frame trackers should run on: a downscaled grayscale copy
+    of the frame, or the frame itself when scale is 1
+    """
+    if scale == 1:
+        return frame
+    small = cv2.resize(frame, None, fx=scale, fy=scale,
+                       interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+
+def scale_box(box, scale):
+    """ Scales an (x, y, w, h) or (x1, y1, x2, y2) box """
+    return tuple(v * scale for v in box)
@@ -0,0 +1,76 @@
+import subprocess
+
+from config import config
+
+
+class VideoEncoder(object):
+    """ Encodes BGR frames into a streamable H.264 mp4 in a single pass, by
+        piping them raw into ffmpeg. Frames must all be width x height.
+        Use as a context manager, or call close once every frame is written.
+    """
+
+    def __init__(self, filename, fps, width, height, preset=None, crf=None,
+                 threads=None):
+        self.filename = filename
+        self.command = [
+            'ffmpeg', '-loglevel', 'error', '-y',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24',
+            '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+            '-codec:v', 'libx264',
+            '-preset', preset or config.VIDEO_PRESET,
+            '-crf', str(config.VIDEO_CRF if crf is None else crf),
+            # 0 lets ffmpeg pick the number of threads
+            '-threads', str(config.VIDEO_THREADS if threads is None
+                            else threads),
+            # most browsers only play 4:2:0 H.264
+            '-pix_fmt', 'yuv420p',
+            # index at the start of the file so it can stream from s3
+            '-movflags', '+faststart',
+            filename]
+        self.process = subprocess.Popen(
+            self.command, stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        try:
+            self.process.stdin.write(frame.tobytes())
+        except BrokenPipeError:
+            # ffmpeg exited early, close raises with its exit code
+            self.close()
+
+    def close(self):
+        if self.process.stdin.closed:
+            return
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self.process.wait() != 0:
+            raise subprocess.CalledProcessError(
+                self.process.returncode, self.command)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # don't mask the original error
+            self.process.kill()
+            self.process.wait()
+
+
+def encode_video(filename, frames, fps):
+    """ Encodes an iterable of frames (sized by the first frame) to filename.
+        Returns whether there were any frames.
+    """
+    frames = iter(frames)
+    first = next(frames, None)
+    if first is None:
+        return False
+    height, width = first.shape[:2]
+    with VideoEncoder(filename, fps, width, height) as encoder:
+        encoder.write(first)
+        for frame in frames:
+            encoder.write(frame)
+    return True